@@ -0,0 +1,230 @@
+"""Banc de mesure du pipeline de patrons : temps, pic mémoire et taille des PDF.
+
+Usage : python benchmark.py [--grids 20,50,100,200,300] [--colors 2,10,20,40]
+                            [--repeat 3] [--threshold 0.25] [--save-baseline]
+
+Chaque cas est mesuré `--repeat` fois (on garde le meilleur temps) puis comparé à
+bench_baseline.json s'il existe : un cas plus lent ou plus gourmand que la
+référence au-delà du seuil est signalé et le code de sortie vaut 1.
+Le temps d'import des modules (démarrage à froid des pages) est mesuré dans un
+process neuf et doit rester sous IMPORT_BUDGET_SECONDS.
+Le test de bout en bout de la factory utilise un faux client Gemini local :
+aucun appel réseau, aucune clé API nécessaire.
+"""
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+import numpy as np
+from PIL import Image, ImageDraw
+import utils
+import metrics
+import pdf_export
+import pattern_file
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(REPO_DIR, "bench_baseline.json")
+IMPORT_BUDGET_SECONDS = {"utils": 0.5, "catalog": 0.5, "pdf_export": 0.8}
+TEXTS = {'main_title': "BENCHMARK", 'sub_title': "Pattern", 'import_note': "Bench", 'copyright': "©2026"}
+
+# --- 1. FAUX CLIENT GEMINI (même forme de réponses que google.genai) ---
+class _Obj:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+def synthetic_illustration(seed=0, size=1024):
+    """Illustration déterministe façon "sticker" : formes pleines cernées de noir sur fond blanc"""
+    rng = np.random.RandomState(seed)
+    img = Image.new("RGB", (size, size), "white")
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x, y = rng.randint(0, size, 2)
+        r = rng.randint(size // 20, size // 5)
+        color = tuple(int(v) for v in rng.randint(0, 256, 3))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=color, outline="black", width=size // 100)
+    return img
+
+class FakeGenaiClient:
+    """Remplace utils.client : images synthétiques et JSON SEO instantanés"""
+    def __init__(self):
+        self.calls = 0
+        self.models = _Obj(generate_content_stream=self._stream, generate_content=self._content)
+
+    def _stream(self, model, contents, config=None):
+        self.calls += 1
+        buf = io.BytesIO()
+        synthetic_illustration(self.calls).save(buf, format="PNG")
+        yield _Obj(parts=[_Obj(inline_data=_Obj(data=buf.getvalue()))])
+
+    def _content(self, model, contents, config=None):
+        self.calls += 1
+        seo = {"title": "Benchmark pattern", "description": "Offline benchmark listing.",
+               "tags": ", ".join(f"tag{i}" for i in range(13))}
+        return _Obj(text=json.dumps(seo))
+
+# --- 2. MESURE ---
+def measure(func, repeat):
+    """Meilleur temps sur `repeat` essais et pic mémoire Python/NumPy (tracemalloc)"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, best, peak
+
+def run_benchmarks(grids, color_counts, repeat, report=print):
+    results = {}
+
+    def record(name, func, size_of=None):
+        result, seconds, peak = measure(func, repeat)
+        entry = {"seconds": round(seconds, 5), "peak_bytes": peak}
+        if size_of is not None:
+            entry["pdf_bytes"] = size_of(result)
+        results[name] = entry
+        extra = f"  {entry['pdf_bytes'] / 1024:8.0f} Ko" if "pdf_bytes" in entry else ""
+        report(f"{name:<32} {seconds * 1000:9.1f} ms  {peak / 2**20:7.1f} Mo{extra}")
+
+    rng = np.random.RandomState(0)
+    pixels = rng.randint(0, 256, (1000, 3))
+    record("get_closest_dmc x1000", lambda: [utils.get_closest_dmc(p) for p in pixels])
+
+    source = synthetic_illustration()
+    for grid in grids:
+        for num_colors in color_counts:
+            case = f"{grid}x{num_colors}"
+            record(f"process_image {case}", lambda: utils.process_image(source, grid, num_colors))
+            processed = utils.process_image(source, grid, num_colors)
+            record(f"get_used_colors_data {case}", lambda: utils.get_used_colors_data(processed))
+            model = utils.build_pattern_model(processed)
+            record(f"flosscross_pdf {case}", lambda: pdf_export.generate_flosscross_pdf(model, TEXTS, False), len)
+            record(f"pk_pdf {case}", lambda: pdf_export.generate_pk_pdf(model), len)
+            # Régénération après un changement de titre : pages de grille déjà en cache
+            with tempfile.TemporaryDirectory() as tile_cache:
+                pdf_export.generate_flosscross_pdf(model, TEXTS, False, tile_cache=tile_cache)
+                edited = dict(TEXTS, main_title="EDITED")
+                record(f"flosscross_pdf cached {case}",
+                       lambda: pdf_export.generate_flosscross_pdf(model, edited, False, tile_cache=tile_cache), len)
+            record(f"save_pattern {case}", lambda: pattern_file.save_pattern(model))
+            data = pattern_file.save_pattern(model)
+            record(f"load_pattern {case}", lambda: pattern_file.load_pattern(data))
+    return results
+
+def measure_import_time(module, repeat):
+    """Temps d'import de `module` dans un interpréteur neuf (meilleur de `repeat`)"""
+    code = f"import time; s = time.perf_counter(); import {module}; print(time.perf_counter() - s)"
+    return min(
+        float(subprocess.run([sys.executable, "-c", code], cwd=REPO_DIR, check=True,
+                             capture_output=True, text=True).stdout)
+        for _ in range(repeat)
+    )
+
+def run_import_benchmarks(repeat, report=print):
+    """Retourne (mesures, dépassements de budget)"""
+    results, over_budget = {}, []
+    for module, budget in IMPORT_BUDGET_SECONDS.items():
+        seconds = measure_import_time(module, repeat)
+        results[f"import {module}"] = {"seconds": round(seconds, 5)}
+        flag = "" if seconds <= budget else f"  > budget {budget:.2f} s"
+        report(f"{'import ' + module:<32} {seconds * 1000:9.1f} ms{flag}")
+        if flag:
+            over_budget.append((f"import {module}", "budget", budget, round(seconds, 5)))
+    return results, over_budget
+
+def run_factory_benchmark(grid, num_colors, report=print):
+    """Production complète d'un sujet avec le faux client, dans un dossier temporaire"""
+    from factory import produce_subject
+
+    timings = {}
+    start = time.perf_counter()
+    produce_subject("benchmark subject", grid, num_colors, report=lambda message: None,
+                    use_cache=False, timings=timings)
+    seconds = time.perf_counter() - start
+    report(f"{'factory end-to-end ' + str(grid) + 'x' + str(num_colors):<32} {seconds * 1000:9.1f} ms  "
+           + ", ".join(f"{name} {value:.2f}s" for name, value in timings.items()))
+    return {f"factory {grid}x{num_colors}": {"seconds": round(seconds, 5)}}
+
+# --- 3. COMPARAISON À LA RÉFÉRENCE ---
+def compare(results, baseline, threshold):
+    """Liste des régressions : (cas, métrique, référence, mesure)"""
+    regressions = []
+    for name, entry in results.items():
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        for metric in ("seconds", "peak_bytes", "pdf_bytes"):
+            if metric in entry and metric in reference and entry[metric] > reference[metric] * (1 + threshold):
+                regressions.append((name, metric, reference[metric], entry[metric]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc de mesure du pipeline de patrons")
+    parser.add_argument("--grids", default="20,50,100,200,300", help="tailles de grille (points)")
+    parser.add_argument("--colors", default="2,10,20,40", help="nombres de couleurs")
+    parser.add_argument("--repeat", type=int, default=3, help="essais par cas (meilleur temps retenu)")
+    parser.add_argument("--threshold", type=float, default=0.25, help="marge tolérée avant régression (0.25 = +25 %%)")
+    parser.add_argument("--factory-grid", type=int, default=100, help="taille du test de bout en bout (0 pour l'ignorer)")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="fichier de référence")
+    parser.add_argument("--save-baseline", action="store_true", help="enregistre les mesures comme nouvelle référence")
+    args = parser.parse_args()
+
+    grids = [int(v) for v in args.grids.split(",")]
+    color_counts = [int(v) for v in args.colors.split(",")]
+
+    # Les mesures du banc ne doivent pas se mêler aux métriques de production
+    metrics.METRICS_PATH = os.devnull
+    utils.client = FakeGenaiClient()
+    utils.GEMINI_RATE_LIMITER.configure(10**6, burst=10**6)
+    print(f"{'Cas':<32} {'temps':>12}  {'pic mém.':>10}  {'PDF':>10}")
+    import_results, over_budget = run_import_benchmarks(args.repeat)
+    results = run_benchmarks(grids, color_counts, args.repeat)
+    results.update(import_results)
+
+    if args.factory_grid:
+        # Exports, catalogue et cache Gemini isolés dans un dossier jetable
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cwd = os.getcwd()
+            os.chdir(tmp_dir)
+            import catalog
+            catalog.CATALOG_PATH = os.path.join(tmp_dir, "catalog.db")
+            utils.GEMINI_CACHE_DIR = os.path.join(tmp_dir, "gemini_cache")
+            try:
+                catalog.init_catalog()
+                results.update(run_factory_benchmark(args.factory_grid, color_counts[-1]))
+            finally:
+                os.chdir(cwd)
+
+    if over_budget:
+        print(f"\n{len(over_budget)} import(s) au-delà du budget :")
+        for name, _, budget, value in over_budget:
+            print(f"  {name} : {value:.3f} s (budget {budget:.2f} s)")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"\nRéférence enregistrée : {args.baseline}")
+        return 1 if over_budget else 0
+
+    if not os.path.exists(args.baseline):
+        print("\nPas de référence : relancez avec --save-baseline pour en créer une.")
+        return 1 if over_budget else 0
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        regressions = compare(results, json.load(f), args.threshold)
+    if not regressions:
+        print(f"\nAucune régression (seuil +{args.threshold:.0%}).")
+        return 1 if over_budget else 0
+    print(f"\n{len(regressions)} régression(s) au-delà de +{args.threshold:.0%} :")
+    for name, metric, reference, value in regressions:
+        print(f"  {name} [{metric}] : {reference} -> {value} ({value / reference - 1:+.0%})")
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
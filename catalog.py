@@ -0,0 +1,271 @@
+import os
+import json
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+from utils import load_manifest
+
+# --- CATALOGUE SQLITE (remplace factory_history.json et le scan de exports/) ---
+CATALOG_PATH = os.environ.get("CATALOG_PATH", "catalog.db")
+LEGACY_HISTORY_PATH = "factory_history.json"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS subjects (
+    subject TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS products (
+    slug TEXT PRIMARY KEY,
+    subject TEXT NOT NULL,
+    status TEXT NOT NULL,
+    grid_cols INTEGER,
+    grid_rows INTEGER,
+    num_colors INTEGER,
+    error TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_products_status_created ON products(status, created_at);
+CREATE TABLE IF NOT EXISTS artifacts (
+    slug TEXT NOT NULL REFERENCES products(slug) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    sha256 TEXT,
+    bytes INTEGER,
+    PRIMARY KEY (slug, name)
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    subject TEXT NOT NULL,
+    slug TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    message TEXT,
+    error TEXT,
+    worker_pid INTEGER,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id);
+CREATE TABLE IF NOT EXISTS job_logs (
+    job_id INTEGER NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+    created_at TEXT NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_job_logs_job ON job_logs(job_id);
+CREATE TABLE IF NOT EXISTS workers (
+    pid INTEGER PRIMARY KEY,
+    heartbeat_at TEXT NOT NULL
+);
+"""
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+def connect():
+    """Nouvelle connexion (une par appel : sqlite3 ne partage pas ses connexions
+    entre threads). Le mode WAL permet plusieurs lecteurs pendant une écriture."""
+    conn = sqlite3.connect(CATALOG_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+def init_catalog():
+    """Crée le schéma puis importe une seule fois l'historique JSON et le dossier exports/"""
+    with closing(connect()) as conn, conn:
+        conn.executescript(SCHEMA)
+        imported = conn.execute("SELECT value FROM meta WHERE key = 'legacy_imported'").fetchone()
+    if not imported:
+        import_legacy()
+
+def import_legacy(history_path=LEGACY_HISTORY_PATH, exports_dir="exports"):
+    """Importe factory_history.json et les produits déjà présents dans exports/"""
+    subjects = []
+    if os.path.exists(history_path):
+        try:
+            with open(history_path, 'r', encoding='utf-8') as f:
+                subjects = json.load(f)
+        except (json.JSONDecodeError, IOError):
+            subjects = []
+
+    products = []
+    if os.path.isdir(exports_dir):
+        for slug in sorted(os.listdir(exports_dir)):
+            path = os.path.join(exports_dir, slug)
+            if os.path.isdir(path):
+                products.append((slug, load_manifest(path)))
+
+    with closing(connect()) as conn, conn:
+        now = _now()
+        conn.executemany(
+            "INSERT OR IGNORE INTO subjects (subject, created_at) VALUES (?, ?)",
+            [(subject, now) for subject in subjects]
+        )
+        for slug, manifest in products:
+            _upsert_product(conn, slug, manifest["subject"] if manifest else slug.replace("_", " "),
+                            "done" if manifest else "failed", manifest)
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_imported', ?)", (now,))
+
+def _upsert_product(conn, slug, subject, status, manifest=None, error=None):
+    now = _now()
+    grid = (manifest or {}).get("grid", {})
+    created_at = (manifest or {}).get("created_at", now)
+    conn.execute(
+        """INSERT INTO products (slug, subject, status, grid_cols, grid_rows, num_colors, error, created_at, updated_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+           ON CONFLICT(slug) DO UPDATE SET
+               subject = excluded.subject, status = excluded.status,
+               grid_cols = COALESCE(excluded.grid_cols, grid_cols),
+               grid_rows = COALESCE(excluded.grid_rows, grid_rows),
+               num_colors = COALESCE(excluded.num_colors, num_colors),
+               error = excluded.error, updated_at = excluded.updated_at""",
+        (slug, subject, status, grid.get("cols"), grid.get("rows"),
+         (manifest or {}).get("num_colors"), error, created_at, now)
+    )
+    if manifest:
+        conn.execute("DELETE FROM artifacts WHERE slug = ?", (slug,))
+        conn.executemany(
+            "INSERT INTO artifacts (slug, name, sha256, bytes) VALUES (?, ?, ?, ?)",
+            [(slug, name, info["sha256"], info["bytes"]) for name, info in manifest["files"].items()]
+        )
+
+def set_product_status(slug, subject, status, manifest=None, error=None):
+    """Enregistre l'état d'un produit : "running", "done" (avec son manifeste) ou "failed" """
+    with closing(connect()) as conn, conn:
+        _upsert_product(conn, slug, subject, status, manifest, error)
+        if status == "done":
+            conn.execute("INSERT OR IGNORE INTO subjects (subject, created_at) VALUES (?, ?)", (subject, _now()))
+
+def get_product_status(slug):
+    with closing(connect()) as conn:
+        row = conn.execute("SELECT status FROM products WHERE slug = ?", (slug,)).fetchone()
+    return row["status"] if row else None
+
+def list_products(limit=None, offset=0, status="done"):
+    """Produits du catalogue, les plus récents d'abord"""
+    with closing(connect()) as conn:
+        return conn.execute(
+            "SELECT * FROM products WHERE status = ? ORDER BY created_at DESC, slug DESC LIMIT ? OFFSET ?",
+            (status, -1 if limit is None else limit, offset)
+        ).fetchall()
+
+def count_products(status="done"):
+    with closing(connect()) as conn:
+        return conn.execute("SELECT COUNT(*) FROM products WHERE status = ?", (status,)).fetchone()[0]
+
+def add_subject(subject):
+    with closing(connect()) as conn, conn:
+        conn.execute("INSERT OR IGNORE INTO subjects (subject, created_at) VALUES (?, ?)", (subject, _now()))
+
+def list_subjects():
+    with closing(connect()) as conn:
+        return [row["subject"] for row in conn.execute("SELECT subject FROM subjects ORDER BY created_at, subject")]
+
+# --- FILE DE JOBS (exécutée par worker.py, hors du process Streamlit) ---
+WORKER_STALE_SECONDS = 30  # worker sans signe de vie depuis 30 s (il en donne toutes les 5 s) : mort
+
+def enqueue_job(subject, slug, params):
+    """Ajoute un sujet à la file, sauf s'il est déjà produit ou déjà en attente/en cours.
+    Retourne l'id du job, ou None si le sujet est ignoré."""
+    with closing(connect()) as conn, conn:
+        done = conn.execute("SELECT 1 FROM products WHERE slug = ? AND status = 'done'", (slug,)).fetchone()
+        active = conn.execute(
+            "SELECT 1 FROM jobs WHERE slug = ? AND status IN ('queued', 'running')", (slug,)
+        ).fetchone()
+        if done or active:
+            return None
+        now = _now()
+        cur = conn.execute(
+            "INSERT INTO jobs (subject, slug, params, status, created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?)",
+            (subject, slug, json.dumps(params), now, now)
+        )
+        return cur.lastrowid
+
+def claim_job(worker_pid):
+    """Réserve le plus ancien job en attente (BEGIN IMMEDIATE : un seul worker le prend)"""
+    conn = connect()
+    conn.isolation_level = None
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker_pid = ?, updated_at = ? WHERE id = ?",
+                (worker_pid, _now(), row["id"])
+            )
+        conn.execute("COMMIT")
+        return row
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+def log_job(job_id, message):
+    """Message de progression (sert aussi de signe de vie du job)"""
+    with closing(connect()) as conn, conn:
+        now = _now()
+        conn.execute("INSERT INTO job_logs (job_id, created_at, message) VALUES (?, ?, ?)", (job_id, now, message))
+        conn.execute("UPDATE jobs SET message = ?, updated_at = ? WHERE id = ?", (message, now, job_id))
+
+def finish_job(job_id, status, error=None):
+    with closing(connect()) as conn, conn:
+        conn.execute("UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                     (status, error, _now(), job_id))
+
+def requeue_stale_jobs(worker_pid):
+    """Remet en file les jobs "running" des workers morts ; la reprise par étapes
+    (state.json) évite de tout refaire.
+
+    Chaque worker a son propre signe de vie (table `workers`) : seuls les jobs d'un
+    pid muet depuis WORKER_STALE_SECONDS sont repris, jamais ceux de `worker_pid`
+    (l'appelant) ni ceux d'un autre worker vivant. Plusieurs workers peuvent donc
+    partager le catalogue."""
+    limit = (datetime.now(timezone.utc) - timedelta(seconds=WORKER_STALE_SECONDS)).isoformat()
+    with closing(connect()) as conn, conn:
+        requeued = conn.execute(
+            """UPDATE jobs SET status = 'queued', worker_pid = NULL, updated_at = ?
+               WHERE status = 'running' AND worker_pid IS NOT ?
+                 AND (worker_pid IS NULL OR worker_pid NOT IN (SELECT pid FROM workers WHERE heartbeat_at >= ?))""",
+            (_now(), worker_pid, limit)
+        ).rowcount
+        conn.execute("DELETE FROM workers WHERE heartbeat_at < ?", (limit,))
+        return requeued
+
+def release_jobs(worker_pid):
+    """Remet en file les jobs encore attribués à `worker_pid` : à appeler au démarrage,
+    avant de prendre un job (un process précédent a pu avoir le même pid, par exemple
+    dans un conteneur relancé)."""
+    with closing(connect()) as conn, conn:
+        return conn.execute(
+            "UPDATE jobs SET status = 'queued', worker_pid = NULL, updated_at = ? WHERE status = 'running' AND worker_pid = ?",
+            (_now(), worker_pid)
+        ).rowcount
+
+def list_jobs(statuses=("queued", "running"), limit=50):
+    marks = ",".join("?" * len(statuses))
+    with closing(connect()) as conn:
+        return conn.execute(
+            f"SELECT * FROM jobs WHERE status IN ({marks}) ORDER BY id DESC LIMIT ?", (*statuses, limit)
+        ).fetchall()
+
+def get_job_logs(job_id):
+    with closing(connect()) as conn:
+        return [row["message"] for row in conn.execute(
+            "SELECT message FROM job_logs WHERE job_id = ? ORDER BY rowid", (job_id,)
+        )]
+
+def set_worker_heartbeat(worker_pid):
+    with closing(connect()) as conn, conn:
+        conn.execute("INSERT OR REPLACE INTO workers (pid, heartbeat_at) VALUES (?, ?)", (worker_pid, _now()))
+
+def get_worker_heartbeat():
+    """Signe de vie le plus récent parmi les workers : {"pid", "at"} ou None"""
+    with closing(connect()) as conn:
+        row = conn.execute("SELECT pid, heartbeat_at FROM workers ORDER BY heartbeat_at DESC LIMIT 1").fetchone()
+    return {"pid": row["pid"], "at": row["heartbeat_at"]} if row else None
@@ -0,0 +1,305 @@
+import os
+import json
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from PIL import Image
+from utils import (
+    generate_pattern_image_func, process_image, build_pattern_model,
+    generate_mockup_func, add_pro_badge,
+    generate_seo_package, write_manifest, write_thumbnails,
+    load_state, save_state, ExportWriter
+)
+from pattern_file import save_pattern, load_pattern, PATTERN_FILE_NAME
+from catalog import init_catalog, set_product_status
+from metrics import span, record
+
+# --- PIPELINE DE PRODUCTION (PAGE 6) ---
+
+def safe_product_name(subject):
+    """Nom de dossier du produit dans exports/"""
+    return "".join([c if c.isalnum() else "_" for c in subject])
+
+def run_stages(stages, report=print, max_workers=4, timings=None):
+    """Exécute un petit graphe d'étapes : chaque étape démarre dès que ses dépendances
+    sont terminées, les étapes indépendantes tournent en même temps.
+
+    `stages` : {nom: (dépendances, message, fonction(résultats))}.
+    Retourne {nom: résultat} ; la première erreur est relancée.
+    Si `timings` est un dict, il reçoit la durée de chaque étape en secondes.
+    """
+    results, running = {}, {}
+    remaining = dict(stages)
+    timings = {} if timings is None else timings
+
+    def timed(name, func):
+        start = time.perf_counter()
+        try:
+            with span(f"stage.{name}"):
+                return func(results)
+        finally:
+            timings[name] = time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while remaining or running:
+            for name, (deps, message, func) in list(remaining.items()):
+                if all(dep in results for dep in deps):
+                    report(message)
+                    running[pool.submit(timed, name, func)] = name
+                    del remaining[name]
+            if not running:
+                raise ValueError(f"Dépendances impossibles à résoudre : {sorted(remaining)}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+    return results
+
+def produce_subject(subject, grid_size, max_colors, report=print, use_cache=True,
+                    cpu_pool=None, timings=None, dither=None, writer=None):
+    """Fabrique un produit complet (image, patron .xsp, mockup, SEO) pour un sujet.
+
+    Après la pixelisation, mockup et SEO (réseau) tournent en même temps. Les PDF
+    sont rendus depuis le patron (.xsp) au premier téléchargement, puis enregistrés
+    dans le dossier du produit.
+    `report(message)` reçoit la progression ; il peut être appelé depuis un thread
+    du pool, il ne doit donc pas toucher à Streamlit.
+    `use_cache=False` ignore le cache des réponses Gemini.
+    `cpu_pool` (ProcessPoolExecutor partagé) reçoit la pixelisation ;
+    `timings` (dict) reçoit la durée de chaque étape.
+    `dither` : tramage de la quantification DMC (voir utils.quantize_to_dmc).
+    `writer` : ExportWriter partagé (sinon un writer propre au sujet).
+    Retourne le chemin du produit une fois tous ses fichiers écrits.
+    """
+    own_writer = writer is None
+    writer = writer or ExportWriter()
+    try:
+        return submit_subject(subject, grid_size, max_colors, writer, report, use_cache,
+                              cpu_pool, timings, dither).result()
+    finally:
+        if own_writer:
+            writer.shutdown()
+
+def submit_subject(subject, grid_size, max_colors, writer, report=print, use_cache=True,
+                   cpu_pool=None, timings=None, dither=None):
+    """Comme produce_subject, mais rend la main dès que les calculs et appels API
+    sont faits : les images restent à encoder et écrire par `writer`.
+    Retourne un Future du chemin du produit, résolu une fois le manifeste écrit."""
+    slug = safe_product_name(subject)
+    prod_path = os.path.join("exports", slug)
+    fields = {"subject": subject, "grid_size": grid_size, "max_colors": max_colors}
+    start = time.perf_counter()
+    set_product_status(slug, subject, "running")
+
+    def failed(e):
+        record("product", time.perf_counter() - start, ok=False, error=f"{type(e).__name__}: {e}"[:300], **fields)
+        set_product_status(slug, subject, "failed", error=str(e))
+
+    def finish(finalize):
+        try:
+            path = finalize()
+        except Exception as e:
+            failed(e)
+            raise
+        record("product", time.perf_counter() - start, **fields)
+        return path
+
+    try:
+        writes, finalize = _produce(subject, prod_path, grid_size, max_colors, report, use_cache,
+                                    cpu_pool, {} if timings is None else timings, dither, writer)
+    except Exception as e:
+        failed(e)
+        raise
+    return writer.after(writes, finish, finalize)
+
+def _load_image(path):
+    with Image.open(path) as img:
+        img.load()
+        return img.copy()
+
+def _pixelize(img_ref, grid_size, max_colors, dither):
+    img_pix = process_image(img_ref, grid_size, max_colors, dither)
+    return img_pix, build_pattern_model(img_pix)
+
+def _on_cpu(cpu_pool, func, *args):
+    """Exécute `func` dans le pool de processus s'il y en a un (le thread d'étape
+    attend le résultat, les appels réseau des autres étapes continuent)"""
+    if cpu_pool is None:
+        return func(*args)
+    return cpu_pool.submit(func, *args).result()
+
+def _produce(subject, prod_path, grid_size, max_colors, report, use_cache, cpu_pool, timings, dither, writer):
+    """Chaque étape est enregistrée de façon atomique dans le dossier produit et notée
+    dans state.json, une fois ses fichiers écrits : une relance reprend à la première
+    étape incomplète. Retourne (écritures en cours, fonction de finalisation)."""
+    texts = {'main_title': subject.upper(), 'sub_title': "Pattern", 'import_note': f"Size: {grid_size}x{grid_size}", 'copyright': "©2026"}
+    params = {"grid_size": grid_size, "max_colors": max_colors, "dither": dither}
+    file = lambda name: os.path.join(prod_path, name)
+
+    state = load_state(prod_path)
+    if state.get("params") != params:
+        # Réglages différents : seule l'image de référence reste réutilisable
+        state["stages"] = [s for s in state.get("stages", []) if s == "ref"]
+    state.update(subject=subject, params=params, complete=False)
+    save_state(prod_path, state)
+    state_lock = threading.Lock()
+    writes = []
+
+    def mark_done(name, futures):
+        for future in futures:
+            future.result()  # déjà terminé : relance l'erreur d'écriture éventuelle
+        with state_lock:
+            if name not in state["stages"]:  # étape refaite (checkpoint illisible) : pas de doublon
+                state["stages"].append(name)
+                save_state(prod_path, state)
+
+    def checkpointed(name, compute, save, load):
+        """`save(valeur)` retourne les Futures des écritures confiées au writer ;
+        l'étape n'est notée dans state.json qu'une fois elles terminées."""
+        def run(r):
+            if name in state["stages"]:
+                try:
+                    value = load(r)
+                    report(f"♻️ Étape « {name} » reprise depuis le disque")
+                    return value
+                except (OSError, ValueError):
+                    pass
+            value = compute(r)
+            futures = save(value)
+            with state_lock:
+                writes.append(writer.after(futures, mark_done, name, futures))
+            return value
+        return run
+
+    # Le patron .xsp est l'artefact de référence : une reprise le relit sans
+    # refaire la correspondance DMC, et les PDF en sont rendus à la demande.
+    def save_pix(res):
+        img_pix, model = res
+        # Un nouveau patron rend obsolètes les PDF déjà rendus depuis l'ancien
+        for variant in ("color", "bw", "pk"):
+            try:
+                os.remove(file(f"{variant}.pdf"))
+            except FileNotFoundError:
+                pass
+        metadata = {"subject": subject, "texts": texts, "params": params,
+                    "created_at": datetime.now(timezone.utc).isoformat()}
+        return [writer.write_image(file("2_pix.png"), img_pix),
+                writer.write_bytes(file(PATTERN_FILE_NAME), save_pattern(model, metadata=metadata))]
+
+    def load_pix(r):
+        model, _ = load_pattern(file(PATTERN_FILE_NAME))
+        return model.image, model
+
+    def save_seo(seo):
+        return [
+            writer.write_bytes(file("seo.json"), json.dumps(seo, ensure_ascii=False).encode("utf-8")),
+            writer.write_bytes(file("seo.txt"), f"TITLE:\n{seo['title']}\n\nTAGS:\n{seo['tags']}\n\nDESCRIPTION:\n{seo['description']}".encode("utf-8")),
+        ]
+
+    def load_seo(r):
+        with open(file("seo.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    stages = {
+        "ref": ((), "🎨 Étape 1 : Génération de l'image de référence...", checkpointed(
+            "ref", lambda r: generate_pattern_image_func(subject, use_cache),
+            lambda img: [writer.write_image(file("1_ref.png"), img)],
+            lambda r: _load_image(file("1_ref.png")))),
+        "pix": (("ref",), f"🧵 Étape 2 : Pixelisation (Grille : {grid_size}x{grid_size})...", checkpointed(
+            "pix", lambda r: _on_cpu(cpu_pool, _pixelize, r["ref"], grid_size, max_colors, dither),
+            save_pix, load_pix)),
+        "mockup": (("pix",), "🖼️ Étape 3 : Création du Mockup...", checkpointed(
+            "mockup", lambda r: add_pro_badge(generate_mockup_func(r["pix"][0], use_cache)),
+            lambda img: [writer.write_image(file("3_mockup.png"), img)],
+            lambda r: _load_image(file("3_mockup.png")))),
+        # ON PASSE ICI LA TAILLE RÉELLE AU SEO
+        "seo": (("pix",), "🔍 Étape 4 : Rédaction SEO (Adaptation Taille + Couleurs)...", checkpointed(
+            "seo", lambda r: generate_seo_package(subject, len(r["pix"][1].palette), grid_size, use_cache),
+            save_seo, load_seo)),
+    }
+    os.makedirs(prod_path, exist_ok=True)
+    try:
+        results = run_stages(stages, report, timings=timings)
+    except Exception:
+        # Les étapes réussies sont notées dans state.json avant de relancer l'erreur
+        wait(list(writes))
+        raise
+    img_ref, (img_pix, model), mock_final = results["ref"], results["pix"], results["mockup"]
+
+    # --- FINALISATION (dans le writer, après toutes les écritures) : le manifeste
+    # et l'état "complete" sont écrits en dernier ---
+    def finalize():
+        for future in writes:
+            future.result()
+        start = time.perf_counter()
+        with span("stage.finalize"):
+            write_thumbnails(prod_path, {"1_ref.png": img_ref, "2_pix.png": img_pix, "3_mockup.png": mock_final})
+            manifest = write_manifest(prod_path, subject, model)
+            state["complete"] = True
+            save_state(prod_path, state)
+
+            set_product_status(os.path.basename(prod_path), subject, "done", manifest)
+        timings["finalize"] = time.perf_counter() - start
+        return prod_path
+
+    return list(writes), finalize
+
+def run_factory_batch(subjects, grid_size, max_colors, max_workers=3, on_event=None, use_cache=True,
+                      cpu_pool=None, timings=None, dither=None, writer=None):
+    """Fabrique plusieurs sujets en parallèle (au plus `max_workers` à la fois).
+
+    Les appels Gemini restent limités par le seau à jetons partagé de utils.
+    `cpu_pool` et `timings` ({sujet: {étape: secondes}}) : voir produce_subject.
+    Un sujet libère sa place dès ses calculs finis : ses fichiers sont écrits par
+    `writer` (ExportWriter partagé, créé au besoin) pendant que le suivant démarre.
+    `on_event(subject, kind, payload)` est toujours appelé depuis le thread
+    appelant, ce qui permet de mettre à jour st.status en direct :
+    - ("log", message) à chaque étape
+    - ("done", chemin du produit) ou ("error", exception) en fin de sujet
+    """
+    init_catalog()
+    on_event = on_event or (lambda subject, kind, payload: None)
+    timings = {} if timings is None else timings
+    events = queue.Queue()
+
+    def drain():
+        while True:
+            try:
+                subject, message = events.get_nowait()
+            except queue.Empty:
+                return
+            on_event(subject, "log", message)
+
+    own_writer = writer is None
+    writer = writer or ExportWriter()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            computing = {
+                pool.submit(
+                    submit_subject, subject, grid_size, max_colors, writer,
+                    lambda message, s=subject: events.put((s, message)), use_cache,
+                    cpu_pool, timings.setdefault(subject, {}), dither
+                ): subject
+                for subject in subjects
+            }
+            writing = {}
+            while computing or writing:
+                done, _ = wait(set(computing) | set(writing), timeout=0.2, return_when=FIRST_COMPLETED)
+                drain()
+                for future in done:
+                    if future in computing:
+                        subject = computing.pop(future)
+                        if future.exception() is None:
+                            writing[future.result()] = subject  # calculs finis, écriture en cours
+                            continue
+                    else:
+                        subject = writing.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        on_event(subject, "done", future.result())
+                    else:
+                        on_event(subject, "error", error)
+    finally:
+        if own_writer:
+            writer.shutdown()
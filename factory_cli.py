@@ -0,0 +1,93 @@
+"""Production Etsy Factory en ligne de commande, sans navigateur (cron, lots de nuit).
+
+Usage : python factory_cli.py sujets.txt [--grid 100] [--colors 15] [--dither ordered|floyd]
+                              [--concurrency 3] [--processes N] [--rate 10] [--no-cache]
+                              [--png-compression 6]
+
+Un sujet par ligne dans le fichier ("-" pour l'entrée standard). La pixelisation
+tourne dans un pool de processus partagé, pendant que les appels Gemini des autres
+sujets continuent. Chaque produit est enregistré sous forme de patron .xsp ; les PDF
+en sont rendus à la demande. Code de sortie 1 si un sujet a échoué.
+"""
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from utils import GEMINI_RATE_LIMITER, DITHER_MODES, PNG_COMPRESS_LEVEL, MAX_GRID_SIZE, ExportWriter
+from catalog import init_catalog, get_product_status
+from factory import safe_product_name, run_factory_batch
+
+STAGE_ORDER = ("ref", "pix", "mockup", "seo", "finalize")
+
+def read_subjects(path):
+    stream = sys.stdin if path == "-" else open(path, 'r', encoding='utf-8')
+    with stream:
+        subjects = [line.strip() for line in stream if line.strip() and not line.startswith("#")]
+    return list(dict.fromkeys(subjects))
+
+def print_timing_summary(timings, elapsed, done, failed):
+    """Durées par étape sur tous les sujets : nombre, total, moyenne, max"""
+    per_stage = {}
+    for stages in timings.values():
+        for name, seconds in stages.items():
+            per_stage.setdefault(name, []).append(seconds)
+
+    print()
+    print(f"{'Étape':<10} {'n':>4} {'total (s)':>10} {'moy. (s)':>9} {'max (s)':>8}")
+    for name in sorted(per_stage, key=lambda n: (STAGE_ORDER.index(n) if n in STAGE_ORDER else len(STAGE_ORDER), n)):
+        values = per_stage[name]
+        print(f"{name:<10} {len(values):>4} {sum(values):>10.2f} {sum(values) / len(values):>9.2f} {max(values):>8.2f}")
+    rate = done / elapsed * 3600 if elapsed else 0
+    print(f"\n{done} produits, {failed} échecs en {elapsed:.1f} s ({rate:.0f} produits/heure)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Production Etsy Factory en ligne de commande")
+    parser.add_argument("subjects", help="fichier de sujets, un par ligne (- pour stdin)")
+    parser.add_argument("--grid", type=int, default=100, help=f"nombre de points (largeur/hauteur, {MAX_GRID_SIZE} max)")
+    parser.add_argument("--colors", type=int, default=15, help="palette DMC max")
+    parser.add_argument("--dither", choices=[mode for mode in DITHER_MODES if mode], help="tramage de la quantification DMC")
+    parser.add_argument("--concurrency", type=int, default=3, help="sujets produits en parallèle")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="processus pour les étapes CPU")
+    parser.add_argument("--rate", type=int, default=10, help="appels API Gemini par minute")
+    parser.add_argument("--no-cache", action="store_true", help="ignore le cache des réponses Gemini")
+    parser.add_argument("--png-compression", type=int, default=PNG_COMPRESS_LEVEL, choices=range(10),
+                        metavar="0-9", help="niveau de compression des PNG exportés")
+    args = parser.parse_args()
+    if not 1 <= args.grid <= MAX_GRID_SIZE:
+        parser.error(f"--grid doit être compris entre 1 et {MAX_GRID_SIZE}")
+
+    init_catalog()
+    GEMINI_RATE_LIMITER.configure(args.rate, burst=2)
+
+    subjects = []
+    for subject in read_subjects(args.subjects):
+        if get_product_status(safe_product_name(subject)) == "done":
+            print(f"⏩ '{subject}' déjà dans l'historique. Ignoré.")
+        else:
+            subjects.append(subject)
+    if not subjects:
+        print("Rien à produire.")
+        return 0
+
+    results = {"done": 0, "error": 0}
+
+    def on_event(subject, kind, payload):
+        if kind == "log":
+            print(f"[{subject}] {payload}", flush=True)
+        else:
+            results[kind] += 1
+            print(f"[{subject}] {'✅ ' + payload if kind == 'done' else '❌ Erreur : ' + str(payload)}", flush=True)
+
+    timings = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.processes) as cpu_pool, \
+            ExportWriter(compress_level=args.png_compression) as writer:
+        run_factory_batch(subjects, args.grid, args.colors, max_workers=args.concurrency,
+                          on_event=on_event, use_cache=not args.no_cache, cpu_pool=cpu_pool, timings=timings,
+                          dither=args.dither, writer=writer)
+    print_timing_summary(timings, time.perf_counter() - start, results["done"], results["error"])
+    return 1 if results["error"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,9 @@
 import streamlit as st
+from datetime import datetime, timedelta, timezone
 from app_auth import check_password
+from catalog import init_catalog, count_products
+from metrics import load_metrics
+from utils import DMC_DB
 
 if not check_password():
     st.stop()
@@ -59,9 +63,13 @@ st.divider()
 
 # --- ÉTAT DU SYSTÈME / DASHBOARD RAPIDE ---
 st.subheader("📈 Aperçu de votre activité")
+init_catalog()
+last_day = [r for r in load_metrics(since=datetime.now(timezone.utc) - timedelta(days=1)) if r["stage"] == "product"]
+failures = sum(1 for r in last_day if not r["ok"])
 d_col1, d_col2, d_col3 = st.columns(3)
-d_col1.metric("Modèles créés", "12", "+2")
-d_col2.metric("Ventes Etsy (simulation)", "128€", "+15%")
-d_col3.metric("Stock Fils DMC", "454 couleurs", "OK")
+d_col1.metric("Modèles créés", count_products(), f"+{len(last_day) - failures} en 24h")
+d_col2.metric("Échecs de production (24h)", failures, f"{failures / len(last_day):.0%}" if last_day else None, delta_color="inverse")
+d_col3.metric("Stock Fils DMC", f"{len(DMC_DB)} couleurs")
+st.page_link("pages/7_📈_Metrics.py", label="Voir les métriques détaillées", icon="📈")
 
 st.info("💡 Conseil : Commencez par l'onglet **AI Generator** pour créer une image, puis passez au **Pattern Studio** pour générer vos fichiers de vente.")
\ No newline at end of file
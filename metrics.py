@@ -0,0 +1,137 @@
+import os
+import glob
+import json
+import math
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from logging.handlers import RotatingFileHandler
+
+# --- MÉTRIQUES DE PERFORMANCE (journaux JSONL tournants, lus par la page Métriques) ---
+# RotatingFileHandler n'est pas sûr entre process : chaque process (Streamlit, worker,
+# CLI, enfants du pool de calcul) écrit son propre fichier metrics.jsonl.<pid>
+METRICS_PATH = os.environ.get("METRICS_PATH", "metrics.jsonl")
+METRICS_MAX_BYTES = 10 * 1024 * 1024
+METRICS_BACKUPS = 3
+METRICS_RETENTION_DAYS = 30  # fichiers de process arrêtés supprimés au-delà (fenêtre max de la page)
+
+_logger = None
+_logger_pid = None
+_logger_lock = threading.Lock()
+
+def _reset_after_fork():
+    # L'enfant d'un fork hérite du handler du parent : il ouvrira le sien
+    global _logger_pid, _logger_lock
+    _logger_pid = None
+    _logger_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def _prune_old_files():
+    limit = time.time() - METRICS_RETENTION_DAYS * 86400
+    for path in glob.glob(glob.escape(METRICS_PATH) + ".*"):
+        try:
+            if os.path.getmtime(path) < limit:
+                os.remove(path)
+        except OSError:
+            pass
+
+def _get_logger():
+    """Logger dédié au process, créé au premier enregistrement (10 Mo par fichier, 3 archives)"""
+    global _logger, _logger_pid
+    with _logger_lock:
+        if _logger_pid != os.getpid():
+            logger = logging.getLogger("stitchai.metrics")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            for inherited in list(logger.handlers):
+                logger.removeHandler(inherited)
+            if METRICS_PATH == os.devnull:
+                path = METRICS_PATH
+            else:
+                _prune_old_files()
+                path = f"{METRICS_PATH}.{os.getpid()}"
+            handler = RotatingFileHandler(path, maxBytes=METRICS_MAX_BYTES,
+                                          backupCount=METRICS_BACKUPS, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            _logger, _logger_pid = logger, os.getpid()
+    return _logger
+
+def record(stage, seconds, ok=True, **fields):
+    """Ajoute une mesure au journal ; une erreur d'écriture ne doit jamais casser la production"""
+    entry = {"ts": datetime.now(timezone.utc).isoformat(), "stage": stage,
+             "seconds": round(seconds, 4), "ok": ok, **fields}
+    try:
+        _get_logger().info(json.dumps(entry, ensure_ascii=False, default=str))
+    except OSError:
+        pass
+
+@contextmanager
+def span(stage, **fields):
+    """Chronomètre un bloc et l'enregistre sous `stage` (ok=False et l'erreur si exception)"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        record(stage, time.perf_counter() - start, ok=False, error=f"{type(e).__name__}: {e}"[:300], **fields)
+        raise
+    record(stage, time.perf_counter() - start, **fields)
+
+def load_metrics(since=None):
+    """Relit les journaux de tous les process et leurs archives, depuis `since`
+    (datetime UTC) ; les mesures sont triées par date"""
+    paths = glob.glob(glob.escape(METRICS_PATH)) + glob.glob(glob.escape(METRICS_PATH) + ".*")
+    limit = since.isoformat() if since else None
+    records = []
+    for path in paths:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # ligne tronquée par un arrêt brutal
+                    if limit is None or entry.get("ts", "") >= limit:
+                        records.append(entry)
+        except FileNotFoundError:
+            continue  # archive supprimée par une rotation entre-temps
+    records.sort(key=lambda entry: entry.get("ts", ""))
+    return records
+
+def percentile(values, q):
+    """Percentile au rang le plus proche (`values` triées)"""
+    if not values:
+        return None
+    rank = max(0, math.ceil(q / 100 * len(values)) - 1)
+    return values[rank]
+
+def summarize(records):
+    """Par étape : nombre, p50, p95, max (s) et taux d'échec"""
+    by_stage = {}
+    for entry in records:
+        by_stage.setdefault(entry["stage"], []).append(entry)
+    summary = []
+    for stage, entries in sorted(by_stage.items()):
+        durations = sorted(e["seconds"] for e in entries)
+        failures = sum(1 for e in entries if not e.get("ok", True))
+        summary.append({
+            "stage": stage, "count": len(entries),
+            "p50": percentile(durations, 50), "p95": percentile(durations, 95), "max": durations[-1],
+            "failure_rate": failures / len(entries),
+        })
+    return summary
+
+def hourly_throughput(records, stage="product", hours=24):
+    """Nombre de `stage` réussis par heure sur les `hours` dernières heures {début d'heure: n}"""
+    now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    buckets = {now - timedelta(hours=h): 0 for h in range(hours - 1, -1, -1)}
+    for entry in records:
+        if entry["stage"] == stage and entry.get("ok", True):
+            hour = datetime.fromisoformat(entry["ts"]).replace(minute=0, second=0, microsecond=0)
+            if hour in buckets:
+                buckets[hour] += 1
+    return buckets
@@ -8,6 +8,7 @@ if not check_password():
 st.title("🎨 AI Image Generator")
 
 subject = st.text_input("Sujet de l'image :", placeholder="Ex: A majestic wolf...")
+force_new = st.checkbox("Forcer une nouvelle génération (ignorer le cache)")
 
 if st.button("Générer l'image", type="primary"):
     if not subject:
@@ -16,7 +17,7 @@ if st.button("Générer l'image", type="primary"):
         with st.spinner("L'IA génère votre design..."):
             try:
                 # Utilisation de ton code déplacé
-                image_result = generate_pattern_image_func(subject)
+                image_result = generate_pattern_image_func(subject, use_cache=not force_new)
 
                 if image_result:
                     st.session_state['generated_img_pil'] = image_result
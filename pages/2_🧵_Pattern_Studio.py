@@ -1,18 +1,41 @@
 import streamlit as st
 from PIL import Image
 import base64
+import hashlib
+from pathlib import Path
 from app_auth import check_password
 # Import des fonctions depuis utils
-from utils import (
-    process_image, get_used_colors_data, 
-    generate_flosscross_pdf, generate_pk_pdf
-)
+from utils import process_image, build_pattern_model, image_hash, DITHER_MODES, MAX_GRID_SIZE
+from pdf_export import cached_pattern_pdf
+from pattern_file import save_pattern, load_pattern, export_oxs
 
 if not check_password():
     st.stop()
 
-def display_pdf(bytes_data):
-    base64_pdf = base64.b64encode(bytes_data).decode('utf-8')
+# --- CACHE ENTRE LES RERUNS ---
+# Les paramètres préfixés par "_" ne sont pas hashés par Streamlit : la clé est
+# l'empreinte de l'image + les réglages, pas l'objet PIL lui-même.
+@st.cache_data(max_entries=16, show_spinner="Pixelisation...")
+def cached_pattern(img_hash, grid_size, num_colors, dither, _image):
+    proc = process_image(_image, grid_size, num_colors, dither)
+    return proc, build_pattern_model(proc)
+
+@st.cache_data(max_entries=16, show_spinner="Lecture du patron...")
+def cached_pattern_file(file_hash, _data):
+    model, _ = load_pattern(_data)
+    return model.image, model
+
+# Les PDF rendus sont gardés sur disque (pas en mémoire de session) : le nom du
+# fichier est l'empreinte du pattern et des réglages, il sert de cache.
+def cached_pdf(pattern_key, texts, bw_mode, pk_compatible, model):
+    variant = "pk" if pk_compatible else "bw" if bw_mode else "color"
+    with st.spinner("Génération du PDF..."):
+        return cached_pattern_pdf(model, variant, texts, pattern_key)
+
+PREVIEW_MAX_GRID_SIZE = 200
+
+def display_pdf(path):
+    base64_pdf = base64.b64encode(Path(path).read_bytes()).decode('utf-8')
     pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}" width="100%" height="800" type="application/pdf"></iframe>'
     st.markdown(pdf_display, unsafe_allow_html=True)
 
@@ -26,9 +49,10 @@ custom_texts = {
     'copyright': st.sidebar.text_input("Copyright", "©2026 My Copyright")
 }
 
-grid_size = st.sidebar.slider("Grid Size (Stitches)", 20, 200, 100)
+grid_size = st.sidebar.slider("Grid Size (Stitches)", 20, MAX_GRID_SIZE, 100)
 num_colors = st.sidebar.slider("Colors", 2, 40, 15)
 bw_mode = st.sidebar.checkbox("Black & White Mode")
+dither = st.sidebar.selectbox("Dithering", DITHER_MODES, format_func=lambda mode: {None: "None", "ordered": "Ordered (Bayer)", "floyd": "Floyd–Steinberg"}[mode])
 pk_compatible = st.sidebar.toggle("Pattern Keeper Compatible")
 
 ai_image = st.session_state.get('generated_img_pil', None)
@@ -38,33 +62,58 @@ if ai_image:
     if st.sidebar.toggle("Utiliser l'image de l'IA", value=True):
         img_to_process = ai_image
 
-uploaded_file = st.sidebar.file_uploader("Ou uploader manuellement", type=["jpg", "png"])
+# Un patron .xsp (export de la factory) est rechargé tel quel : pas de pixelisation
+uploaded_file = st.sidebar.file_uploader("Ou uploader manuellement", type=["jpg", "png", "xsp"])
+pattern_data = None
 if uploaded_file:
-    img_to_process = Image.open(uploaded_file)
+    if uploaded_file.name.lower().endswith(".xsp"):
+        pattern_data = uploaded_file.getvalue()
+    else:
+        img_to_process = Image.open(uploaded_file)
 
-if img_to_process:
-    proc = process_image(img_to_process, grid_size, num_colors)
+if pattern_data or img_to_process:
+    if pattern_data:
+        pattern_key = (hashlib.sha1(pattern_data).hexdigest(),)
+        try:
+            proc, model = cached_pattern_file(*pattern_key, pattern_data)
+        except (ValueError, KeyError) as e:
+            st.error(f"Patron illisible : {e}")
+            st.stop()
+        st.sidebar.caption("Patron .xsp chargé : taille, couleurs et tramage sont ceux du fichier.")
+    else:
+        pattern_key = (image_hash(img_to_process), grid_size, num_colors, dither)
+        proc, model = cached_pattern(*pattern_key, img_to_process)
     
     # --- LA LIGNE CORRECTRICE CI-DESSOUS ---
     st.session_state['processed_img_pil'] = proc 
     # ---------------------------------------
     
-    used_colors = get_used_colors_data(proc)
+    st.session_state['pattern_model'] = model
     
     col1, col2 = st.columns([1, 1])
     with col1:
         st.subheader("Final Stitch Preview")
-        st.image(proc.resize((600, int(600*(proc.size[1]/proc.size[0]))), Image.NEAREST), use_container_width=True)
-        st.sidebar.metric(label="DMC Threads used", value=len(used_colors))
+        # Grands formats : on affiche au moins un pixel par point pour ne pas perdre de détail
+        preview_w = max(600, proc.size[0])
+        st.image(proc.resize((preview_w, int(preview_w*(proc.size[1]/proc.size[0]))), Image.NEAREST), use_container_width=True)
+        st.sidebar.metric(label="DMC Threads used", value=len(model.palette))
 
     with col2:
         st.subheader("PDF Output")
-        if pk_compatible:
-            pdf_bytes = generate_pk_pdf(proc, used_colors)
-        else:
-            pdf_bytes = generate_flosscross_pdf(proc, custom_texts, bw_mode, used_colors)
-            display_pdf(pdf_bytes)
+        # Le PDF n'est rendu qu'à la demande : aperçu activé ou clic sur le téléchargement
+        def get_pdf():
+            return cached_pdf(pattern_key, custom_texts, bw_mode, pk_compatible, model)
+
+        # Au-delà de 200 points le PDF compte des centaines de pages : trop lourd pour l'aperçu intégré
+        if max(model.rows, model.cols) > PREVIEW_MAX_GRID_SIZE:
+            st.caption(f"Aperçu désactivé au-delà de {PREVIEW_MAX_GRID_SIZE} points : téléchargez le PDF.")
+        elif not pk_compatible and st.toggle("👁️ Aperçu du PDF"):
+            display_pdf(get_pdf())
         
-        st.download_button(label="💾 Download PDF", data=pdf_bytes, file_name="pattern_export.pdf", mime="application/pdf")
+        st.download_button(label="💾 Download PDF", data=lambda: Path(get_pdf()).read_bytes(), file_name="pattern_export.pdf", mime="application/pdf")
+        st.download_button(label="🧵 Download Pattern (.xsp)", data=lambda: save_pattern(model, metadata={"texts": custom_texts}),
+                           file_name="pattern.xsp", mime="application/octet-stream")
+        st.download_button(label="🔁 Export OXS", data=lambda: export_oxs(model, title=custom_texts['main_title']),
+                           file_name="pattern.oxs", mime="application/xml")
 else:
-    st.info("Awaiting image...")
\ No newline at end of file
+    st.info("Awaiting image...")
@@ -19,6 +19,7 @@ if design_img:
     with col1:
         st.subheader("Source (Pixelated Pattern)")
         st.image(design_img, use_container_width=True)
+        force_new = st.checkbox("Forcer une nouvelle génération (ignorer le cache)")
         btn = st.button("🚀 Générer l'image Etsy", type="primary", use_container_width=True)
 
     with col2:
@@ -26,7 +27,7 @@ if design_img:
             with st.spinner("L'IA crée la mise en scène et applique le branding..."):
                 try:
                     # Utilisation des fonctions centralisées
-                    raw_mockup = generate_mockup_func(design_img)
+                    raw_mockup = generate_mockup_func(design_img, use_cache=not force_new)
                     if raw_mockup:
                         final_shop_image = add_pro_badge(raw_mockup)
                         st.session_state['last_gen'] = final_shop_image
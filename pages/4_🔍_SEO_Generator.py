@@ -1,6 +1,8 @@
 import streamlit as st
+import os
 from app_auth import check_password
-from utils import generate_seo_package, get_used_colors_data
+from utils import generate_seo_package, load_manifest, MAX_GRID_SIZE
+from catalog import init_catalog, list_products
 
 if not check_password():
     st.stop()
@@ -12,15 +14,26 @@ st.markdown("---")
 
 # --- RÉCUPÉRATION DES DONNÉES DE SESSION (Optionnel) ---
 default_subject = st.session_state.get('last_subject_from_generator', "")
-processed_img = st.session_state.get('processed_img_pil')
+pattern_model = st.session_state.get('pattern_model')
+
+# Specs d'un produit déjà exporté : lues dans son manifeste, sans redécoder d'image
+init_catalog()
+saved_product = st.selectbox("Partir d'un produit exporté (optionnel)", ["—"] + [p["slug"] for p in list_products()])
+manifest = load_manifest(os.path.join("exports", saved_product)) if saved_product != "—" else None
 
 # On tente de récupérer les specs réelles si elles existent
-if processed_img:
-    auto_colors = len(get_used_colors_data(processed_img))
-    auto_grid = processed_img.size[0]
+if manifest:
+    default_subject = manifest["subject"]
+    auto_colors = manifest["num_colors"]
+    auto_grid = manifest["grid"]["cols"]
+elif pattern_model:
+    auto_colors = len(pattern_model.palette)
+    auto_grid = pattern_model.cols
 else:
     auto_colors = 15
     auto_grid = 100
+# Patrons non carrés : la largeur peut sortir des bornes du champ
+auto_grid = min(max(auto_grid, 20), MAX_GRID_SIZE)
 
 st.subheader("1. Spécifications du produit")
 col_sub, col_grid, col_col = st.columns([2, 1, 1])
@@ -29,7 +42,7 @@ with col_sub:
     visual_concept = st.text_input("Sujet du design", value=default_subject)
 with col_grid:
     # Nouveau slider pour la taille de grille
-    grid_val = st.number_input("Taille (points)", value=auto_grid, min_value=20, max_value=200)
+    grid_val = st.number_input("Taille (points)", value=auto_grid, min_value=20, max_value=MAX_GRID_SIZE)
 with col_col:
     color_val = st.number_input("Nombre de couleurs", value=auto_colors)
 
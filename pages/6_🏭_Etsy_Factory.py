@@ -1,13 +1,17 @@
 import streamlit as st
-import io
 import os
-from PIL import Image
+from functools import partial
+from pathlib import Path
+from datetime import datetime, timezone
 from app_auth import check_password
 from utils import (
-    generate_pattern_image_func, process_image, get_used_colors_data,
-    generate_flosscross_pdf, generate_pk_pdf, generate_mockup_func, 
-    add_pro_badge, generate_seo_package, load_factory_history, save_to_factory_history,
-    ensure_export_dir
+    ensure_export_dir, load_manifest, ensure_thumbnails, atomic_write, DITHER_MODES, MAX_GRID_SIZE
+)
+from factory import safe_product_name
+from pattern_file import load_pattern, export_oxs, PATTERN_FILE_NAME
+from catalog import (
+    init_catalog, list_products, count_products, enqueue_job, list_jobs, get_job_logs,
+    get_worker_heartbeat, WORKER_STALE_SECONDS
 )
 
 if not check_password():
@@ -15,6 +19,7 @@ if not check_password():
 
 st.set_page_config(page_title="Etsy Factory Ultra", layout="wide")
 ensure_export_dir()
+init_catalog()
 
 # --- CSS POUR LA NETTETÉ DES PIXELS (Pixel-Art rendering) ---
 st.markdown("""
@@ -38,99 +43,115 @@ st.title("🏭 Etsy Factory Pro")
 # --- BARRE LATÉRALE ---
 with st.sidebar:
     st.header("⚙️ Configuration")
-    grid_size = st.slider("Nombre de points (Largeur/Hauteur)", 40, 200, 100) 
+    grid_size = st.slider("Nombre de points (Largeur/Hauteur)", 40, MAX_GRID_SIZE, 100)
     max_colors = st.slider("Palette DMC max", 5, 40, 15)
+    dither = st.selectbox("Tramage", DITHER_MODES, format_func=lambda mode: {None: "Aucun", "ordered": "Ordonné (Bayer)", "floyd": "Floyd–Steinberg"}[mode])
+    use_cache = not st.toggle("Ignorer le cache API", help="Force de nouveaux appels Gemini même si la réponse est déjà en cache.")
     st.divider()
     st.info("Stockage local actif : /exports")
 
 # --- INPUT ---
 subjects_input = st.text_area("Liste des nouveaux sujets :", placeholder="A vintage space rocket...", height=100)
 
+# La production tourne dans worker.py : la page ne fait qu'ajouter des jobs à la
+# file et afficher leur avancement (le lot continue si l'onglet est fermé).
 if st.button("⚡ Lancer la production", type="primary", use_container_width=True):
     subjects = [s.strip() for s in subjects_input.split('\n') if s.strip()]
+    params = {"grid_size": grid_size, "max_colors": max_colors, "dither": dither, "use_cache": use_cache}
     
     for subject in subjects:
-        safe_name = "".join([c if c.isalnum() else "_" for c in subject])
-        prod_path = os.path.join("exports", safe_name)
-        
-        if os.path.exists(prod_path):
-            st.warning(f"⏩ '{subject}' déjà dans l'historique. Ignoré.")
+        if enqueue_job(subject, safe_product_name(subject), params) is None:
+            st.warning(f"⏩ '{subject}' déjà dans l'historique ou en cours. Ignoré.")
+        else:
+            st.toast(f"📥 '{subject}' ajouté à la file")
+
+@st.fragment(run_every=3)
+def production_queue():
+    jobs = list_jobs(("queued", "running", "failed"), limit=20)
+    if not jobs:
+        return
+    st.subheader("⏳ File de production")
+    heartbeat = get_worker_heartbeat()
+    alive = heartbeat and (datetime.now(timezone.utc) - datetime.fromisoformat(heartbeat["at"])).total_seconds() < WORKER_STALE_SECONDS
+    if not alive:
+        st.warning("Aucun worker actif. Lancez `python worker.py` sur le serveur pour traiter la file.")
+    for job in jobs:
+        if job["status"] == "queued":
+            st.caption(f"🕒 {job['subject']} : en attente")
             continue
-            
-        with st.status(f"🛠️ Fabrication de : {subject}...", expanded=True) as status:
-            try:
-                st.write("🎨 Étape 1 : Génération de l'image de référence...")
-                img_ref = generate_pattern_image_func(subject)
-                
-                st.write(f"🧵 Étape 2 : Pixelisation (Grille : {grid_size}x{grid_size})...")
-                img_pix = process_image(img_ref, grid_size, max_colors)
-                colors_data = get_used_colors_data(img_pix)
-                
-                st.write("🖼️ Étape 3 : Création du Mockup...")
-                mock_raw = generate_mockup_func(img_pix)
-                mock_final = add_pro_badge(mock_raw)
-                
-                st.write("🔍 Étape 4 : Rédaction SEO (Adaptation Taille + Couleurs)...")
-                # ON PASSE ICI LA TAILLE RÉELLE AU SEO
-                seo = generate_seo_package(subject, len(colors_data), grid_size)
-                
-                st.write("📄 Étape 5 : Génération des 3 versions PDF...")
-                texts = {'main_title': subject.upper(), 'sub_title': "Pattern", 'import_note': f"Size: {grid_size}x{grid_size}", 'copyright': "©2026"}
-                pdf_color = generate_flosscross_pdf(img_pix, texts, False, colors_data)
-                pdf_bw = generate_flosscross_pdf(img_pix, texts, True, colors_data)
-                pdf_pk = generate_pk_pdf(img_pix, colors_data)
-                
-                # --- SAUVEGARDE PHYSIQUE ---
-                os.makedirs(prod_path)
-                img_ref.save(os.path.join(prod_path, "1_ref.png"))
-                img_pix.save(os.path.join(prod_path, "2_pix.png"))
-                mock_final.save(os.path.join(prod_path, "3_mockup.png"))
-                with open(os.path.join(prod_path, "seo.txt"), "w", encoding="utf-8") as f:
-                    f.write(f"TITLE:\n{seo['title']}\n\nTAGS:\n{seo['tags']}\n\nDESCRIPTION:\n{seo['description']}")
-                with open(os.path.join(prod_path, "color.pdf"), "wb") as f: f.write(pdf_color)
-                with open(os.path.join(prod_path, "bw.pdf"), "wb") as f: f.write(pdf_bw)
-                with open(os.path.join(prod_path, "pk.pdf"), "wb") as f: f.write(pdf_pk)
-                
-                save_to_factory_history(subject)
-                status.update(label=f"✅ {subject} Terminé !", state="complete")
-            except Exception as e:
-                st.error(f"Erreur sur {subject}: {e}")
+        state = "error" if job["status"] == "failed" else "running"
+        label = f"❌ {job['subject']} en erreur" if state == "error" else f"🛠️ Fabrication de : {job['subject']}..."
+        with st.status(label, state=state, expanded=state == "running"):
+            for message in get_job_logs(job["id"]):
+                st.write(message)
+
+production_queue()
+
+# --- TÉLÉCHARGEMENTS ---
+# La factory ne produit que le patron .xsp : chaque PDF en est rendu au premier clic
+# puis enregistré dans le dossier du produit, qui reste complet et autonome.
+# Les anciens exports ont déjà leurs PDF.
+def product_pdf_bytes(path, variant):
+    pdf_path = Path(path, f"{variant}.pdf")
+    if pdf_path.exists():
+        return pdf_path.read_bytes()
+    from pdf_export import generate_pattern_pdfs  # reportlab chargé seulement au téléchargement
+
+    model, metadata = load_pattern(os.path.join(path, PATTERN_FILE_NAME))
+    data = generate_pattern_pdfs(model, metadata["texts"], (variant,), workers=1)[variant]
+    atomic_write(str(pdf_path), data)
+    return data
+
+def product_oxs_bytes(path):
+    model, metadata = load_pattern(os.path.join(path, PATTERN_FILE_NAME))
+    return export_oxs(model, title=metadata.get("subject", ""))
 
 # --- AFFICHAGE DE LA LISTE ---
 st.divider()
 st.subheader("📦 Historique Complet")
 
-if os.path.exists("exports"):
-    product_folders = sorted(os.listdir("exports"), reverse=True)
-    
-    for folder in product_folders:
-        path = os.path.join("exports", folder)
-        if os.path.isdir(path):
-            with st.expander(f"📁 PRODUIT : {folder.replace('_', ' ')}", expanded=False):
-                col_img1, col_img2, col_img3 = st.columns(3)
-                
-                img_ref = Image.open(os.path.join(path, "1_ref.png"))
-                img_pix = Image.open(os.path.join(path, "2_pix.png"))
-                mockup = Image.open(os.path.join(path, "3_mockup.png"))
-                
-                col_img1.image(img_ref, caption="Référence IA", use_container_width=True)
-                # L'image suivante sera nette grâce au CSS injecté plus haut
-                col_img2.image(img_pix, caption=f"Rendu Pixel-Perfect", use_container_width=True)
-                col_img3.image(mockup, caption="Mockup Etsy", use_container_width=True)
-
-                st.divider()
-                
-                col_seo, col_dl = st.columns([2, 1])
-                with col_seo:
-                    if os.path.exists(os.path.join(path, "seo.txt")):
-                        with open(os.path.join(path, "seo.txt"), "r", encoding="utf-8") as f:
-                            st.text_area("SEO (Taille & Couleurs incluses)", f.read(), height=220, key=f"seo_{folder}")
-
-                with col_dl:
-                    st.write("📥 Télécharger :")
-                    with open(os.path.join(path, "color.pdf"), "rb") as f:
-                        st.download_button("🎨 PDF Couleur", f.read(), f"{folder}_color.pdf", key=f"dl_c_{folder}", use_container_width=True)
-                    with open(os.path.join(path, "bw.pdf"), "rb") as f:
-                        st.download_button("🏁 PDF Noir & Blanc", f.read(), f"{folder}_bw.pdf", key=f"dl_b_{folder}", use_container_width=True)
-                    with open(os.path.join(path, "pk.pdf"), "rb") as f:
-                        st.download_button("📱 Pattern Keeper", f.read(), f"{folder}_pk.pdf", key=f"dl_p_{folder}", use_container_width=True)
\ No newline at end of file
+PRODUCTS_PER_PAGE = 10
+
+total_products = count_products()
+num_pages = max(1, (total_products + PRODUCTS_PER_PAGE - 1) // PRODUCTS_PER_PAGE)
+col_page, col_count = st.columns([1, 3])
+page = col_page.number_input("Page", min_value=1, max_value=num_pages, value=1)
+col_count.caption(f"{total_products} produits · page {page}/{num_pages}")
+
+# Seuls les produits de la page courante sont chargés (requête indexée), avec
+# leurs miniatures ; les PDF ne sont lus qu'au clic sur le téléchargement.
+for product in list_products(limit=PRODUCTS_PER_PAGE, offset=(page - 1) * PRODUCTS_PER_PAGE):
+    folder = product["slug"]
+    path = os.path.join("exports", folder)
+    manifest = load_manifest(path)
+    thumbs = ensure_thumbnails(path)
+    with st.expander(f"📁 PRODUIT : {folder.replace('_', ' ')}", expanded=False):
+        if manifest:
+            grid = manifest["grid"]
+            st.caption(f"{grid['cols']}x{grid['rows']} points · {manifest['num_colors']} couleurs DMC · "
+                       f"{manifest['stitches']} points brodés · créé le {manifest['created_at'][:10]}")
+        # Le rendu pixelisé sera net grâce au CSS injecté plus haut ; une image absente
+        # (produit interrompu, étape en échec) est remplacée par un simple encadré
+        for col_img, name, caption in zip(st.columns(3), ("1_ref.png", "2_pix.png", "3_mockup.png"),
+                                          ("Référence IA", "Rendu Pixel-Perfect", "Mockup Etsy")):
+            if thumbs[name]:
+                col_img.image(thumbs[name], caption=caption, use_container_width=True)
+            else:
+                col_img.info(f"{caption} : image indisponible")
+
+        st.divider()
+        
+        col_seo, col_dl = st.columns([2, 1])
+        with col_seo:
+            if os.path.exists(os.path.join(path, "seo.txt")):
+                with open(os.path.join(path, "seo.txt"), "r", encoding="utf-8") as f:
+                    st.text_area("SEO (Taille & Couleurs incluses)", f.read(), height=220, key=f"seo_{folder}")
+
+        with col_dl:
+            st.write("📥 Télécharger :")
+            st.download_button("🎨 PDF Couleur", partial(product_pdf_bytes, path, "color"), f"{folder}_color.pdf", key=f"dl_c_{folder}", use_container_width=True)
+            st.download_button("🏁 PDF Noir & Blanc", partial(product_pdf_bytes, path, "bw"), f"{folder}_bw.pdf", key=f"dl_b_{folder}", use_container_width=True)
+            st.download_button("📱 Pattern Keeper", partial(product_pdf_bytes, path, "pk"), f"{folder}_pk.pdf", key=f"dl_p_{folder}", use_container_width=True)
+            if os.path.exists(os.path.join(path, PATTERN_FILE_NAME)):
+                st.download_button("🧵 Patron (.xsp)", Path(path, PATTERN_FILE_NAME).read_bytes, f"{folder}.xsp", key=f"dl_x_{folder}", use_container_width=True)
+                st.download_button("🔁 OXS", partial(product_oxs_bytes, path), f"{folder}.oxs", key=f"dl_o_{folder}", use_container_width=True)
@@ -0,0 +1,60 @@
+import streamlit as st
+import pandas as pd
+from datetime import datetime, timedelta, timezone
+from app_auth import check_password
+from metrics import load_metrics, summarize, hourly_throughput
+
+if not check_password():
+    st.stop()
+
+st.set_page_config(page_title="Métriques de production", layout="wide")
+st.title("📈 Métriques de production")
+
+# --- FENÊTRE D'ANALYSE ---
+WINDOWS = {"24 heures": 24, "7 jours": 24 * 7, "30 jours": 24 * 30}
+window = st.sidebar.selectbox("Période", list(WINDOWS))
+hours = WINDOWS[window]
+records = load_metrics(since=datetime.now(timezone.utc) - timedelta(hours=hours))
+
+if not records:
+    st.info("Aucune mesure sur la période. Les durées sont enregistrées dans metrics.jsonl.* (un fichier par process) à chaque production.")
+    st.stop()
+
+# --- PRODUITS ---
+products = [r for r in records if r["stage"] == "product"]
+done = [r for r in products if r["ok"]]
+durations = sorted(r["seconds"] for r in done)
+
+col1, col2, col3, col4 = st.columns(4)
+col1.metric("Produits fabriqués", len(done))
+col2.metric("Échecs", len(products) - len(done),
+            f"{(len(products) - len(done)) / len(products):.0%}" if products else None, delta_color="inverse")
+col3.metric("Débit moyen", f"{len(done) / hours:.1f} / heure")
+col4.metric("Durée médiane d'un produit", f"{durations[len(durations) // 2]:.0f} s" if durations else "-")
+
+st.subheader("🏭 Produits terminés par heure")
+throughput = hourly_throughput(records, hours=min(hours, 24 * 7))
+st.bar_chart(pd.Series(throughput, name="produits").rename_axis("heure"))
+
+# --- LATENCES PAR ÉTAPE ---
+st.subheader("⏱️ Latence par étape")
+summary = pd.DataFrame(summarize(records)).set_index("stage")
+st.dataframe(
+    summary,
+    use_container_width=True,
+    column_config={
+        "count": st.column_config.NumberColumn("Appels"),
+        "p50": st.column_config.NumberColumn("p50 (s)", format="%.2f"),
+        "p95": st.column_config.NumberColumn("p95 (s)", format="%.2f"),
+        "max": st.column_config.NumberColumn("max (s)", format="%.2f"),
+        "failure_rate": st.column_config.ProgressColumn("Taux d'échec", format="percent", min_value=0, max_value=1),
+    },
+)
+st.caption("stage.* : étapes de la factory · api.* : appels Gemini · pdf.* : rendu PDF · "
+           "pixelize / dmc_match : traitement d'image · disk.write : écritures sur disque")
+
+# --- DERNIÈRES ERREURS ---
+errors = [r for r in records if not r["ok"]][-20:]
+if errors:
+    st.subheader("❌ Dernières erreurs")
+    st.dataframe(pd.DataFrame(errors)[["ts", "stage", "error"]].iloc[::-1], use_container_width=True, hide_index=True)
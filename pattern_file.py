@@ -0,0 +1,113 @@
+"""Format natif des patrons (.xsp) et export vers les formats d'échange.
+
+Un fichier .xsp contient tout ce qu'il faut pour re-rendre les PDF sans repasser
+par le traitement d'image : palette DMC, grille d'index compressée (uint8/uint16),
+symboles et métadonnées (sujet, textes du PDF, réglages de production).
+
+Disposition binaire :
+    b"XSTP" | version (u8) | taille de l'en-tête (u32, big-endian) | en-tête JSON UTF-8 | grille zlib
+"""
+import io
+import json
+import zlib
+import struct
+from xml.sax.saxutils import quoteattr
+import numpy as np
+from PIL import Image
+from utils import PatternModel, open_output
+
+PATTERN_FILE_NAME = "pattern.xsp"
+PATTERN_MAGIC = b"XSTP"
+PATTERN_VERSION = 1
+_PREFIX = struct.Struct(">4sBI")
+_GRID_DTYPES = {"u1": np.dtype("u1"), "u2": np.dtype("<u2")}
+
+# --- 1. FORMAT NATIF ---
+def save_pattern(model, output=None, metadata=None):
+    """Écrit le PatternModel au format .xsp (voir open_output pour `output`)"""
+    dtype = "u1" if len(model.palette) <= 256 else "u2"
+    header = {
+        "rows": model.rows, "cols": model.cols, "dtype": dtype,
+        "palette": [dict(dmc) for dmc in model.palette],
+        "symbols": list(model.symbols),
+        "metadata": metadata or {},
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    grid_bytes = np.ascontiguousarray(model.grid, dtype=_GRID_DTYPES[dtype]).tobytes()
+    with open_output(output) as (stream, result):
+        stream.write(_PREFIX.pack(PATTERN_MAGIC, PATTERN_VERSION, len(header_bytes)))
+        stream.write(header_bytes)
+        stream.write(zlib.compress(grid_bytes, 9))
+    return result()
+
+def load_pattern(source):
+    """Relit un fichier .xsp (chemin, octets ou flux binaire).
+
+    Retourne (PatternModel, métadonnées). L'image du modèle est reconstruite à partir
+    des couleurs de la palette (un pixel par point), les comptes à partir de la grille.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        data = bytes(source)
+    elif hasattr(source, "read"):
+        data = source.read()
+    else:
+        with open(source, 'rb') as f:
+            data = f.read()
+
+    if len(data) < _PREFIX.size:
+        raise ValueError("Fichier de patron tronqué")
+    magic, version, header_len = _PREFIX.unpack_from(data)
+    if magic != PATTERN_MAGIC:
+        raise ValueError("Ce fichier n'est pas un patron .xsp")
+    if version > PATTERN_VERSION:
+        raise ValueError(f"Version de patron non prise en charge : {version}")
+    header = json.loads(data[_PREFIX.size:_PREFIX.size + header_len].decode("utf-8"))
+    try:
+        grid_bytes = zlib.decompress(data[_PREFIX.size + header_len:])
+    except zlib.error as e:
+        raise ValueError(f"Grille du patron illisible : {e}") from e
+
+    rows, cols, palette = header["rows"], header["cols"], header["palette"]
+    grid = np.frombuffer(grid_bytes, dtype=_GRID_DTYPES[header["dtype"]]).reshape(rows, cols)
+    grid = grid.astype(np.uint8 if header["dtype"] == "u1" else np.uint16)
+    if grid.size and grid.max() >= len(palette):
+        raise ValueError("Grille du patron incohérente avec sa palette")
+    counts = np.bincount(grid.reshape(-1), minlength=len(palette))
+    palette_rgb = np.array([(dmc["r"], dmc["g"], dmc["b"]) for dmc in palette], dtype=np.uint8).reshape(-1, 3)
+    image = Image.fromarray(palette_rgb[grid])
+    return PatternModel(image, palette, grid, counts, header["symbols"]), header["metadata"]
+
+# --- 2. EXPORT OXS (Open Cross Stitch, XML lu par Pattern Keeper, Ursa, FlossCross...) ---
+OXS_ROWS_PER_WRITE = 64
+
+def export_oxs(model, output=None, title=""):
+    """Écrit le patron au format OXS : palette (l'index 0 est la toile) et points
+    complets. La grille est sérialisée par paquets de lignes, sans tout garder en mémoire."""
+    with open_output(output) as (stream, result):
+        out = io.TextIOWrapper(stream, encoding="utf-8", newline="\n", write_through=True)
+        out.write('<?xml version="1.0" encoding="UTF-8"?>\n<chart>\n')
+        out.write('<format comments01="Designed to allow interchange of basic pattern data between any cross stitch program"/>\n')
+        out.write(f'<properties oxsversion="1.0" software="StitchAI" chartheight="{model.rows}" '
+                  f'chartwidth="{model.cols}" charttitle={quoteattr(title)} author="" copyright="" instructions="" '
+                  f'stitchesperinch="14" stitchesperinch_y="14" palettecount="{len(model.palette)}"/>\n')
+        out.write('<palette>\n<palette_item index="0" number="cloth" name="cloth" color="FFFFFF" '
+                  'printcolor="FFFFFF" blendcolor="nil" comments="aida" strands="2" symbol="0" '
+                  'dashpattern="" bsstrands="2" bscolor="FFFFFF"/>\n')
+        for i, (dmc, sym) in enumerate(zip(model.palette, model.symbols), start=1):
+            color = f"{dmc['r']:02X}{dmc['g']:02X}{dmc['b']:02X}"
+            out.write(f'<palette_item index="{i}" number={quoteattr("DMC " + str(dmc["floss"]))} '
+                      f'name={quoteattr(dmc["description"])} color="{color}" printcolor="{color}" '
+                      f'blendcolor="nil" comments="" strands="2" symbol={quoteattr(sym)} dashpattern="" '
+                      f'bsstrands="1" bscolor="{color}"/>\n')
+        out.write('</palette>\n<fullstitches>\n')
+        for y0 in range(0, model.rows, OXS_ROWS_PER_WRITE):
+            block = model.grid[y0:y0 + OXS_ROWS_PER_WRITE].astype(np.intp) + 1
+            out.write("".join(
+                f'<stitch x="{x}" y="{y0 + dy}" palindex="{p}"/>\n'
+                for dy, row in enumerate(block.tolist()) for x, p in enumerate(row)
+            ))
+        out.write('</fullstitches>\n<partstitches>\n</partstitches>\n<backstitches>\n</backstitches>\n'
+                  '<ornaments_inc_knots_and_beads>\n</ornaments_inc_knots_and_beads>\n'
+                  '<commentboxes>\n</commentboxes>\n</chart>\n')
+        out.detach()
+    return result()
@@ -0,0 +1,510 @@
+import io
+import os
+import json
+import hashlib
+import tempfile
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from reportlab.pdfgen import canvas
+from reportlab.pdfgen.pathobject import PDFPathObject
+from reportlab.lib.pagesizes import A4
+from reportlab.lib import colors
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from utils import PatternModel, open_output, evict_lru
+from metrics import span
+
+# --- GÉNÉRATEURS DE PDF (PAGE 2) ---
+# Module séparé de utils : reportlab n'est chargé que par les pages qui exportent.
+def _text_color(dmc):
+    bright = (dmc["r"] * 299 + dmc["g"] * 587 + dmc["b"] * 114) / 1000
+    return colors.white if bright < 125 else colors.black
+
+def _block_geometry(grid, symbols, x_range, y_range, origin, cell_size, font_ratio, thick_every=None):
+    """Prépare une zone de grille une seule fois, indépendamment du style.
+
+    Le résultat est rejoué tel quel dans chaque variante (couleur, N&B) :
+    - fills : {index palette: chemin} segments horizontaux de même couleur fusionnés
+    - thin / thick : chemins de la grille fine et épaisse (tous les `thick_every` points)
+    - glyphs : {index palette: (symbole, [(x, y), ...])} origines des symboles centrés
+    """
+    (x_start, x_end), (y_start, y_end) = x_range, y_range
+    draw_x, draw_y = origin
+    sub = grid[y_start:y_end, x_start:x_end]
+    h, w = sub.shape
+
+    run_start = np.ones(sub.shape, dtype=bool)
+    run_start[:, 1:] = sub[:, 1:] != sub[:, :-1]
+    ys, xs = np.nonzero(run_start)
+    same_row = np.append(ys[1:] == ys[:-1], False)
+    ends = np.where(same_row, np.append(xs[1:], 0), w)
+    vals = sub[ys, xs]
+    fills = {}
+    for idx in np.unique(vals):
+        sel = vals == idx
+        path = PDFPathObject()
+        for y, x0, x1 in zip(ys[sel], xs[sel], ends[sel]):
+            path.rect(draw_x + x0 * cell_size, draw_y - (y + 1) * cell_size, (x1 - x0) * cell_size, cell_size)
+        fills[int(idx)] = path
+
+    x_right, y_bottom = draw_x + w * cell_size, draw_y - h * cell_size
+    thin, thick = PDFPathObject(), PDFPathObject()
+    for i in range(w + 1):
+        target = thick if thick_every and (x_start + i) % thick_every == 0 else thin
+        target.moveTo(draw_x + i * cell_size, draw_y)
+        target.lineTo(draw_x + i * cell_size, y_bottom)
+    for j in range(h + 1):
+        target = thick if thick_every and (y_start + j) % thick_every == 0 else thin
+        target.moveTo(draw_x, draw_y - j * cell_size)
+        target.lineTo(x_right, draw_y - j * cell_size)
+
+    font_size = cell_size * font_ratio
+    glyphs = {}
+    for idx in fills:
+        sym = symbols[idx]
+        half_w = stringWidth(sym, "Helvetica", font_size) / 2
+        cy, cx = np.nonzero(sub == idx)
+        glyphs[idx] = (sym, list(zip(draw_x + (cx + 0.5) * cell_size - half_w, draw_y - (cy + 0.75) * cell_size)))
+    return {"fills": fills, "thin": thin, "thick": thick if thick_every else None,
+            "font_size": font_size, "glyphs": glyphs}
+
+def _paint_grid_block(c, geom, styles, line_color):
+    """Dessine une zone préparée avec un nombre minimal d'opérations PDF :
+    un chemin par couleur, deux chemins de grille, un seul objet texte."""
+    for idx, path in geom["fills"].items():
+        c.setFillColorRGB(*styles[idx][0])
+        c.drawPath(path, fill=1, stroke=0)
+
+    c.setLineWidth(0.1)
+    c.setStrokeColor(line_color)
+    c.drawPath(geom["thin"], fill=0, stroke=1)
+    if geom["thick"] is not None:
+        c.setLineWidth(0.7)
+        c.setStrokeColor(colors.black)
+        c.drawPath(geom["thick"], fill=0, stroke=1)
+
+    text = c.beginText()
+    text.setFont("Helvetica", geom["font_size"])
+    for idx, (sym, positions) in geom["glyphs"].items():
+        text.setFillColor(styles[idx][1])
+        for x, y in positions:
+            text.setTextOrigin(x, y)
+            text.textOut(sym)
+    c.drawText(text)
+    c.setFillColor(colors.black)
+
+MAX_POINTS_PER_PAGE = 50
+PARALLEL_MIN_PAGES = 4  # en dessous, le coût du pool dépasse le gain
+
+def _grid_styles(model, bw_mode):
+    """Couleurs (remplissage, texte) calculées une fois par entrée de palette"""
+    styles = []
+    for dmc in model.palette:
+        if bw_mode:
+            luma = (dmc["r"] * 0.299 + dmc["g"] * 0.587 + dmc["b"] * 0.114) / 255
+            adj = 0.6 + (luma * 0.4) 
+            styles.append(((adj, adj, adj), colors.black))
+        else:
+            fill_color = (dmc["r"]/255, dmc["g"]/255, dmc["b"]/255)
+            styles.append((fill_color, _text_color(dmc)))
+    line_color = colors.grey if bw_mode else colors.lightgrey
+    return styles, line_color
+
+def _tile_layout(rows, cols, points_per_page=MAX_POINTS_PER_PAGE):
+    """Découpage de la grille en pages de 50x50 : [(px, py, (x0, x1), (y0, y1)), ...]"""
+    num_pages_x = (cols + points_per_page - 1) // points_per_page
+    num_pages_y = (rows + points_per_page - 1) // points_per_page
+    return [
+        (px, py,
+         (px * points_per_page, min((px+1)*points_per_page, cols)),
+         (py * points_per_page, min((py+1)*points_per_page, rows)))
+        for py in range(num_pages_y) for px in range(num_pages_x)
+    ]
+
+def _draw_cover(c, model, user_texts):
+    width, height = A4
+    margin = 50
+    rows, cols = model.rows, model.cols
+    c.setFont("Helvetica", 14)
+    c.drawCentredString(width/2, height - 50, user_texts['main_title'])
+    c.setLineWidth(0.5)
+    c.line(margin, height - 70, width - margin, height - 70)
+    
+    img_display_w = 350
+    img_display_h = (rows/cols) * img_display_w
+    c.drawInlineImage(model.image, (width-img_display_w)/2, height-450, width=img_display_w, height=img_display_h)
+    
+    c.setFont("Helvetica", 10)
+    c.drawCentredString(width/2, height-500, f"Design size: {cols} x {rows} stitches")
+    c.drawString(margin, 100, user_texts['import_note'])
+    c.drawString(margin, 60, user_texts['copyright'])
+    c.drawRightString(width - margin, 60, "Page 1")
+
+def _tile_geometry(model, tile):
+    """Cadre et géométrie d'une page de grille (identiques pour toutes les variantes)"""
+    width, height = A4
+    _, _, x_range, y_range = tile
+    current_w, current_h = x_range[1] - x_range[0], y_range[1] - y_range[0]
+    cell_size = min((width - 100) / current_w, (height - 120) / current_h)
+    draw_x, draw_y = (width - (current_w * cell_size)) / 2, (height - 60)
+    return _block_geometry(model.grid, model.symbols, x_range, y_range, (draw_x, draw_y),
+                           cell_size, 0.7, thick_every=10)
+
+def _draw_tile_frame(c, tile, title, page_num):
+    """En-tête et numéro d'une page de grille (seule partie qui dépend des textes)"""
+    width, height = A4
+    margin = 50
+    px, py = tile[0], tile[1]
+    c.setFont("Helvetica-Bold", 10)
+    c.drawCentredString(width/2, height - 25, f"{title} - Part {px+1},{py+1}")
+    c.setFont("Helvetica", 8)
+    c.drawRightString(width - margin, 30, f"Page {page_num}")
+
+def _draw_tile_page(c, tile, title, geom, styles, line_color, page_num):
+    _draw_tile_frame(c, tile, title, page_num)
+    _paint_grid_block(c, geom, styles, line_color)
+
+def _draw_legend(c, model, bw_mode):
+    width, height = A4
+    margin = 50
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(margin, height - 50, "Thread Legend (DMC)")
+    y_pos = height - 100
+    for dmc, count, sym in zip(model.palette, model.counts, model.symbols):
+        if bw_mode:
+            c.setFillColor(colors.white)
+            c.setStrokeColor(colors.black)
+            c.rect(margin, y_pos - 2, 12, 12, fill=1, stroke=1)
+            c.setFillColor(colors.black)
+        else:
+            c.setFillColorRGB(dmc["r"]/255, dmc["g"]/255, dmc["b"]/255)
+            c.rect(margin, y_pos - 2, 12, 12, fill=1)
+            c.setFillColor(_text_color(dmc))
+        
+        c.drawCentredString(margin + 6, y_pos + 1, sym)
+        c.setFillColor(colors.black)
+        c.drawString(margin + 40, y_pos, str(dmc["floss"]))
+        c.drawString(margin + 100, y_pos, dmc["description"])
+        c.drawString(margin + 300, y_pos, str(count))
+        y_pos -= 20
+        if y_pos < 50:
+            c.showPage()
+            y_pos = height - 50
+
+def _new_flosscross_canvases(model, streams):
+    """Un canvas A4 par mode demandé : {bw_mode: (canvas, (styles, line_color))}"""
+    return {bw_mode: (canvas.Canvas(stream, pagesize=A4), _grid_styles(model, bw_mode))
+            for bw_mode, stream in streams.items()}
+
+def _draw_tile_pages(outputs, model, tiles, title, first_page_num):
+    """Dessine les pages de grille dans tous les canvas en un seul parcours :
+    la géométrie de chaque page est calculée une fois et rejouée dans chaque mode."""
+    for page_num, tile in enumerate(tiles, start=first_page_num):
+        geom = _tile_geometry(model, tile)
+        for c, (styles, line_color) in outputs.values():
+            _draw_tile_page(c, tile, title, geom, styles, line_color, page_num)
+            c.showPage()
+
+# Modèle transmis une seule fois à chaque process du pool (sans l'image PIL)
+_WORKER_MODEL = None
+
+def _init_render_worker(model):
+    global _WORKER_MODEL
+    _WORKER_MODEL = model
+
+def _render_tile_chunk(tiles, title, paths, first_page_num):
+    """Rend une suite de pages de grille dans des PDF autonomes écrits sur disque
+    (exécuté dans le pool : seuls les chemins repassent entre les process)"""
+    with ExitStack() as stack:
+        streams = {bw_mode: stack.enter_context(open(path, 'wb')) for bw_mode, path in paths.items()}
+        outputs = _new_flosscross_canvases(_WORKER_MODEL, streams)
+        _draw_tile_pages(outputs, _WORKER_MODEL, tiles, title, first_page_num)
+        for c, _ in outputs.values():
+            c.save()
+
+def _render_flosscross_parallel(model, user_texts, streams, tiles, workers):
+    """Couverture et légende dans le process courant, pages de grille dans un pool,
+    puis assemblage dans l'ordre : la numérotation est fixée avant l'envoi au pool.
+    Les morceaux passent par des fichiers temporaires, pas par la mémoire."""
+    from pypdf import PdfWriter  # seul usage de pypdf : importé à la demande
+
+    shared = PatternModel(None, model.palette, model.grid, model.counts, model.symbols)
+    chunk_size = (len(tiles) + workers - 1) // workers
+    chunks = [tiles[i:i + chunk_size] for i in range(0, len(tiles), chunk_size)]
+    part = lambda name, bw_mode: os.path.join(tmp_dir, f"{name}_{int(bw_mode)}.pdf")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with ProcessPoolExecutor(max_workers=len(chunks), initializer=_init_render_worker,
+                                 initargs=(shared,)) as pool:
+            futures = [
+                pool.submit(_render_tile_chunk, chunk, user_texts['main_title'],
+                            {bw_mode: part(i, bw_mode) for bw_mode in streams}, 2 + i * chunk_size)
+                for i, chunk in enumerate(chunks)
+            ]
+
+            for bw_mode in streams:
+                c = canvas.Canvas(part("cover", bw_mode), pagesize=A4)
+                _draw_cover(c, model, user_texts)
+                c.save()
+
+                c = canvas.Canvas(part("legend", bw_mode), pagesize=A4)
+                _draw_legend(c, model, bw_mode)
+                c.save()
+
+            for future in futures:
+                future.result()
+
+        for bw_mode, stream in streams.items():
+            writer = PdfWriter()
+            for name in ["cover"] + list(range(len(chunks))) + ["legend"]:
+                writer.append(part(name, bw_mode))
+            writer.write(stream)
+
+# --- CACHE DES PAGES DE GRILLE (régénération incrémentale) ---
+# Chaque page de grille est gardée seule dans un PDF d'une page, sans en-tête ni
+# numéro, sous l'empreinte de ses cellules et de leurs styles. Changer un texte ou
+# un fil ne re-rend que la couverture, la légende et les pages réellement touchées ;
+# titres et numéros sont posés ensuite par une surcouche légère.
+TILE_CACHE_VERSION = 1  # à incrémenter si le dessin de la grille change
+
+def _touch_cached(path):
+    """Vrai si le fichier est en cache ; il est alors marqué comme récemment utilisé (LRU)"""
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+def _tile_cache_key(model, tile, bw_mode, styles):
+    """Empreinte d'une page de grille : cellules renumérotées localement (une couleur
+    ajoutée ailleurs dans la palette ne change pas la clé), styles et symboles utilisés."""
+    _, _, (x0, x1), (y0, y1) = tile
+    used, local = np.unique(model.grid[y0:y1, x0:x1], return_inverse=True)
+    h = hashlib.sha1(json.dumps([TILE_CACHE_VERSION, bw_mode, [x0, x1, y0, y1]]).encode("utf-8"))
+    for idx in used.tolist():
+        fill, text_color = styles[idx]
+        h.update(json.dumps([[round(v, 6) for v in fill], text_color.hexval(), model.symbols[idx]]).encode("utf-8"))
+    h.update(local.astype(np.uint16).tobytes())
+    return h.hexdigest()
+
+def _render_tile_files(model, jobs):
+    """Écrit chaque page de grille demandée dans son propre PDF : [(tile, {bw_mode: chemin})]"""
+    grid_styles = {}
+    for tile, paths in jobs:
+        geom = _tile_geometry(model, tile)
+        for bw_mode, path in paths.items():
+            if bw_mode not in grid_styles:
+                grid_styles[bw_mode] = _grid_styles(model, bw_mode)
+            with open_output(path) as (stream, _):
+                c = canvas.Canvas(stream, pagesize=A4)
+                _paint_grid_block(c, geom, *grid_styles[bw_mode])
+                c.save()
+
+def _render_tile_files_worker(jobs):
+    _render_tile_files(_WORKER_MODEL, jobs)
+
+def _stack_frame(writer, page, frame):
+    """Place le contenu de `frame` (en-tête, numéro) sous celui de `page`, sans décoder
+    ni recompresser les flux : les deux pages viennent de reportlab (contenus isolés
+    par q/Q). Si deux polices portent le même nom, on revient à merge_page."""
+    from pypdf.generic import ArrayObject, NameObject
+
+    fonts = page["/Resources"].get_object().get("/Font")
+    fonts = fonts.get_object() if fonts is not None else None
+    frame_fonts = frame["/Resources"].get_object().get("/Font")
+    frame_fonts = frame_fonts.get_object() if frame_fonts is not None else {}
+    if fonts is None or any(name in fonts and fonts[name].get_object()["/BaseFont"] != font.get_object()["/BaseFont"]
+                            for name, font in frame_fonts.items()):
+        page.merge_page(frame, over=False)
+        return
+    for name, font in frame_fonts.items():
+        if name not in fonts:
+            fonts[NameObject(name)] = font.clone(writer).indirect_reference
+    contents = page.raw_get("/Contents")  # référence indirecte : le flux n'est pas dupliqué
+    contents = list(contents.get_object()) if isinstance(contents.get_object(), ArrayObject) else [contents]
+    frame_stream = frame["/Contents"].clone(writer)
+    page[NameObject("/Contents")] = ArrayObject([frame_stream.indirect_reference] + contents)
+
+def _render_flosscross_cached(model, user_texts, streams, tiles, workers, cache_dir):
+    """Assemble le PDF à partir des pages de grille en cache ; seules les pages absentes
+    sont rendues (en parallèle s'il y en a assez). Couverture, légende et surcouche des
+    en-têtes sont toujours refaites : elles ne coûtent presque rien."""
+    from pypdf import PdfReader, PdfWriter
+
+    styles = {bw_mode: _grid_styles(model, bw_mode)[0] for bw_mode in streams}
+    paths = [{bw_mode: os.path.join(cache_dir, f"{_tile_cache_key(model, tile, bw_mode, styles[bw_mode])}.pdf")
+              for bw_mode in streams} for tile in tiles]
+    missing = [(tile, {bw_mode: path for bw_mode, path in tile_paths.items() if not _touch_cached(path)})
+               for tile, tile_paths in zip(tiles, paths)]
+    missing = [(tile, tile_paths) for tile, tile_paths in missing if tile_paths]
+
+    with span("pdf.tiles", cached=len(tiles) - len(missing), rendered=len(missing)):
+        if workers and workers > 1 and len(missing) >= PARALLEL_MIN_PAGES:
+            shared = PatternModel(None, model.palette, model.grid, model.counts, model.symbols)
+            workers = min(workers, len(missing))
+            chunk_size = (len(missing) + workers - 1) // workers
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_render_worker,
+                                     initargs=(shared,)) as pool:
+                for future in [pool.submit(_render_tile_files_worker, missing[i:i + chunk_size])
+                               for i in range(0, len(missing), chunk_size)]:
+                    future.result()
+        else:
+            _render_tile_files(model, missing)
+
+    frames = io.BytesIO()
+    c = canvas.Canvas(frames, pagesize=A4)
+    for page_num, tile in enumerate(tiles, start=2):
+        _draw_tile_frame(c, tile, user_texts['main_title'], page_num)
+        c.showPage()
+    c.save()
+    frame_pages = PdfReader(frames).pages
+
+    for bw_mode, stream in streams.items():
+        extras = {}
+        for name, draw in (("cover", lambda c: _draw_cover(c, model, user_texts)),
+                           ("legend", lambda c: _draw_legend(c, model, bw_mode))):
+            extras[name] = io.BytesIO()
+            c = canvas.Canvas(extras[name], pagesize=A4)
+            draw(c)
+            c.save()
+
+        writer = PdfWriter()
+        writer.append(extras["cover"])
+        for tile_paths, frame in zip(paths, frame_pages):
+            _stack_frame(writer, writer.add_page(PdfReader(tile_paths[bw_mode]).pages[0]), frame)
+        writer.append(extras["legend"])
+        writer.write(stream)
+
+def _render_flosscross(model, user_texts, outputs, workers=None, tile_cache=None):
+    """Rend le PDF FlossCross pour chaque mode demandé.
+
+    `outputs` : {bw_mode: cible} (voir open_output). Retourne {bw_mode: octets, chemin ou flux}.
+    `tile_cache` : dossier du cache des pages de grille (régénération incrémentale).
+    """
+    tiles = _tile_layout(model.rows, model.cols)
+    variants = "+".join("bw" if bw_mode else "color" for bw_mode in outputs)
+    with ExitStack() as stack:
+        stack.enter_context(span(f"pdf.{variants}", pages=len(tiles) + 2, parallel=bool(workers and workers > 1)))
+        opened = {bw_mode: stack.enter_context(open_output(target)) for bw_mode, target in outputs.items()}
+        streams = {bw_mode: stream for bw_mode, (stream, _) in opened.items()}
+
+        if tile_cache:
+            os.makedirs(tile_cache, exist_ok=True)
+            _render_flosscross_cached(model, user_texts, streams, tiles, workers, tile_cache)
+        elif workers and workers > 1 and len(tiles) >= PARALLEL_MIN_PAGES:
+            _render_flosscross_parallel(model, user_texts, streams, tiles, min(workers, len(tiles)))
+        else:
+            canvases = _new_flosscross_canvases(model, streams)
+
+            # PAGE 1 : COUVERTURE
+            for c, _ in canvases.values():
+                _draw_cover(c, model, user_texts)
+                c.showPage()
+
+            # GÉNÉRATION DES PAGES (un seul parcours pour tous les modes)
+            _draw_tile_pages(canvases, model, tiles, user_texts['main_title'], 2)
+
+            # PAGE LÉGENDE
+            for bw_mode, (c, _) in canvases.items():
+                _draw_legend(c, model, bw_mode)
+                c.save()
+    return {bw_mode: result() for bw_mode, (_, result) in opened.items()}
+
+def generate_flosscross_pdf(model, user_texts, bw_mode, workers=None, output=None, tile_cache=None):
+    """PDF FlossCross : couverture, pages de grille 50x50, légende.
+
+    Avec `workers` > 1, les pages de grille des grands patrons sont rendues en
+    parallèle dans des process séparés puis assemblées (ordre et numéros identiques).
+    `output` : None (retourne les octets), chemin de fichier ou flux binaire.
+    `tile_cache` : dossier où réutiliser les pages de grille déjà rendues.
+    """
+    return _render_flosscross(model, user_texts, {bw_mode: output}, workers, tile_cache)[bw_mode]
+
+# Pattern Keeper : 15 pt par point et au plus 200x200 points par page, soit des pages
+# d'environ 3100 pt, bien sous la limite de 14400 pt des lecteurs PDF.
+PK_CELL_SIZE = 15
+PK_MAX_POINTS_PER_PAGE = 200
+
+def _draw_pk_legend(c, model, draw_x, y_leg):
+    """Légende simplifiée pour Pattern Keeper, continuée sur des pages A4 si besoin
+    (la page de la dernière tuile peut être minuscule)"""
+    c.setFillColor(colors.black)
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(draw_x, y_leg, "Legend")
+    y_leg -= 20
+    for dmc in model.palette:
+        if y_leg < 20:
+            c.showPage()
+            c.setPageSize(A4)
+            c.setFont("Helvetica-Bold", 12)
+            y_leg = A4[1] - 50
+        c.drawString(draw_x, y_leg, f"DMC {dmc['floss']} - {dmc['description']}")
+        y_leg -= 15
+
+def generate_pk_pdf(model, output=None):
+    """Grille Pattern Keeper, découpée en pages de PK_MAX_POINTS_PER_PAGE points de côté
+    (une seule page jusqu'à 200x200). La légende suit la dernière page de grille."""
+    rows, cols = model.rows, model.cols
+    cell_size = PK_CELL_SIZE
+    tiles = _tile_layout(rows, cols, PK_MAX_POINTS_PER_PAGE)
+    styles = [((dmc["r"]/255, dmc["g"]/255, dmc["b"]/255), _text_color(dmc)) for dmc in model.palette]
+    with span("pdf.pk", cells=rows * cols, pages=len(tiles)), open_output(output) as (stream, result):
+        c = canvas.Canvas(stream)
+        for i, (px, py, x_range, y_range) in enumerate(tiles):
+            tile_w, tile_h = x_range[1] - x_range[0], y_range[1] - y_range[0]
+            pw, ph = (tile_w * cell_size) + 100, (tile_h * cell_size) + 150
+            c.setPageSize((pw, ph))
+            draw_x, draw_y = 50, ph - 50
+            if len(tiles) > 1:
+                c.setFont("Helvetica-Bold", 10)
+                c.drawString(draw_x, ph - 30, f"Part {px+1},{py+1} - columns {x_range[0]+1}-{x_range[1]}, "
+                                              f"rows {y_range[0]+1}-{y_range[1]}")
+            geom = _block_geometry(model.grid, model.symbols, x_range, y_range, (draw_x, draw_y), cell_size, 0.6)
+            _paint_grid_block(c, geom, styles, colors.lightgrey)
+            if i < len(tiles) - 1:
+                c.showPage()
+
+        _draw_pk_legend(c, model, draw_x, draw_y - (tile_h * cell_size) - 40)
+        c.save()
+    return result()
+
+PDF_VARIANTS = ("color", "bw", "pk")
+
+def generate_pattern_pdfs(model, user_texts, variants=PDF_VARIANTS, workers=None, outputs=None, tile_cache=None):
+    """Point d'entrée unique de l'export : rend toutes les variantes demandées
+    ("color", "bw", "pk") en partageant découpage, géométrie et couleurs.
+
+    Les versions couleur et N&B sont produites dans le même parcours des pages.
+    `outputs` : {variante: chemin ou flux} pour écrire directement sur disque ;
+    une variante absente est retournée en octets. Retourne {variante: résultat}.
+    `tile_cache` : voir generate_flosscross_pdf.
+    """
+    outputs = outputs or {}
+    bw_modes = {mode: outputs.get(variant) for variant, mode in (("color", False), ("bw", True)) if variant in variants}
+    rendered = _render_flosscross(model, user_texts, bw_modes, workers, tile_cache) if bw_modes else {}
+    pdfs = {"bw" if bw_mode else "color": data for bw_mode, data in rendered.items()}
+    if "pk" in variants:
+        pdfs["pk"] = generate_pk_pdf(model, outputs.get("pk"))
+    return pdfs
+
+# --- RENDU À LA DEMANDE (CACHE DISQUE) ---
+# PDF rendus depuis un patron (Pattern Studio), nommés par l'empreinte du patron,
+# de la variante et des textes, avec les pages de grille du cache incrémental.
+# Par défaut dans le dossier temporaire du système (PDF_CACHE_DIR pour le déplacer) ;
+# les fichiers les moins récemment utilisés sont supprimés au-delà de PDF_CACHE_MAX_BYTES.
+PDF_CACHE_DIR = os.environ.get("PDF_CACHE_DIR", os.path.join(tempfile.gettempdir(), "crossstitch_pdfs"))
+PDF_CACHE_MAX_BYTES = int(os.environ.get("PDF_CACHE_MAX_BYTES", 500 * 1024 * 1024))
+TILE_CACHE_DIR = os.path.join(PDF_CACHE_DIR, "tiles")
+
+def cached_pattern_pdf(model, variant, user_texts, pattern_key):
+    """Chemin du PDF `variant` du patron, rendu seulement s'il n'est pas déjà en cache.
+    `pattern_key` identifie le contenu du patron (ex : empreinte du fichier .xsp)."""
+    texts = None if variant == "pk" else user_texts  # la version Pattern Keeper n'affiche pas les textes
+    key = hashlib.sha1(json.dumps([pattern_key, variant, texts], sort_keys=True).encode("utf-8")).hexdigest()
+    path = os.path.join(PDF_CACHE_DIR, f"{key}.pdf")
+    if not _touch_cached(path):
+        # Rendu en série : appelé depuis le serveur Streamlit, pas de pool de processus par clic
+        generate_pattern_pdfs(model, user_texts, (variant,), workers=1, outputs={variant: path},
+                              tile_cache=TILE_CACHE_DIR)
+        evict_lru(PDF_CACHE_DIR, PDF_CACHE_MAX_BYTES)
+    return path
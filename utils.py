@@ -1,30 +1,320 @@
-import streamlit as st
 import os
 import io
 import json
 import base64
+import hashlib
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, Future, wait as futures_wait
+from datetime import datetime, timezone
+import numpy as np
 from PIL import Image, ImageOps, ImageDraw, ImageFont
-from google import genai
-from google.genai import types
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
+from metrics import span
 
 # --- 1. INITIALISATION CLIENT & DATA ---
-try:
-    client = genai.Client(api_key=st.secrets["GEMINI_API_KEY"])
-except KeyError:
-    st.error("Clé API 'GEMINI_API_KEY' manquante dans les secrets.")
+# google.genai (~1 s d'import) et le client ne sont chargés qu'au premier appel API
+client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    global client
+    with _client_lock:
+        if client is None:
+            import streamlit as st
+            from google import genai
+            try:
+                api_key = st.secrets["GEMINI_API_KEY"]
+            except KeyError:
+                st.error("Clé API 'GEMINI_API_KEY' manquante dans les secrets.")
+                raise RuntimeError("Clé API 'GEMINI_API_KEY' manquante dans les secrets.")
+            client = genai.Client(api_key=api_key)
+    return client
+
+DMC_JSON_PATH = 'rgb-dmc.json'
+# Palette précompilée (tableau structuré .npy) : ouverte par mmap, sans parser le JSON
+DMC_NPY_PATH = 'rgb-dmc.npy'
+DMC_DTYPE = np.dtype([("floss", "U8"), ("description", "U32"), ("r", "u1"), ("g", "u1"), ("b", "u1"),
+                      ("hex", "U8"), ("row", "U12")])
+
+def _read_dmc_json(json_path=DMC_JSON_PATH):
+    with open(json_path, 'r', encoding='utf-8') as f:
+        db = json.load(f)
+    return np.array([tuple(c[name] for name in DMC_DTYPE.names) for c in db], dtype=DMC_DTYPE)
+
+def compile_dmc_palette(json_path=DMC_JSON_PATH, npy_path=DMC_NPY_PATH):
+    """Convertit rgb-dmc.json en rgb-dmc.npy (à relancer après modification du JSON :
+    python -c "import utils; utils.compile_dmc_palette()")"""
+    table = _read_dmc_json(json_path)
+    with open_output(npy_path) as (f, _):
+        np.save(f, table)
+    return table
+
+def load_dmc_palette():
+    """Palette DMC mappée en mémoire depuis le .npy précompilé.
+
+    Rien n'est écrit à l'import (le dépôt peut être en lecture seule) : si le .npy
+    manque, est illisible ou plus ancien que le JSON, le JSON est lu directement.
+    """
+    try:
+        if not os.path.exists(DMC_JSON_PATH) or os.path.getmtime(DMC_NPY_PATH) >= os.path.getmtime(DMC_JSON_PATH):
+            return np.load(DMC_NPY_PATH, mmap_mode="r")
+    except (OSError, ValueError):
+        pass
+    try:
+        return _read_dmc_json()
+    except OSError:
+        return np.zeros(0, dtype=DMC_DTYPE)
+
+DMC_PALETTE = load_dmc_palette()
+# Entrées sous forme de dicts (mêmes clés que le JSON) pour les légendes et manifestes
+DMC_DB = [dict(zip(DMC_DTYPE.names, row)) for row in DMC_PALETTE.tolist()]
 
-try:
-    with open('rgb-dmc.json', 'r', encoding='utf-8') as f:
-        DMC_DB = json.load(f)
-except FileNotFoundError:
-    DMC_DB = []
+# Index de palette construit une seule fois : tableau (N, 3) des couleurs DMC
+DMC_RGB = np.stack([DMC_PALETTE["r"], DMC_PALETTE["g"], DMC_PALETTE["b"]], axis=1).astype(np.int32)
+
+class TokenBucket:
+    """Limiteur de débit partagé entre threads (seau à jetons).
+
+    `rate_per_minute` jetons sont ajoutés par minute, jusqu'à `burst` ; chaque
+    appel API consomme un jeton et attend s'il n'y en a plus.
+    """
+    def __init__(self, rate_per_minute, burst=1):
+        self._lock = threading.Lock()
+        self._tokens = burst
+        self._last = time.monotonic()
+        self.configure(rate_per_minute, burst)
+
+    def configure(self, rate_per_minute, burst=1):
+        with self._lock:
+            self.rate = rate_per_minute / 60
+            self.burst = burst
+            self._tokens = min(self._tokens, burst)
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+# Quota partagé par tous les appels Gemini du process (réglable depuis la Factory)
+GEMINI_RATE_LIMITER = TokenBucket(rate_per_minute=10, burst=2)
+
+# --- ÉCRITURES ATOMIQUES ---
+# mkstemp crée ses fichiers en 0600 : les fichiers renommés prennent les droits
+# qu'aurait donnés open() avec l'umask du process (lu une fois, à l'import)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+FILE_MODE = 0o666 & ~_UMASK
+
+@contextmanager
+def open_output(output):
+    """Flux binaire d'écriture pour `output`, avec la valeur à retourner ensuite :
+    - None : tampon mémoire, la valeur est ses octets
+    - chemin : fichier temporaire renommé à la fin (jamais de fichier à moitié écrit),
+      la valeur est le chemin
+    - flux déjà ouvert : écrit tel quel, la valeur est le flux
+    """
+    if output is None:
+        buffer = io.BytesIO()
+        yield buffer, buffer.getvalue
+    elif isinstance(output, (str, os.PathLike)):
+        path = os.fspath(output)
+        folder = os.path.dirname(path) or "."
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                yield f, lambda: path
+            os.chmod(tmp_path, FILE_MODE)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    else:
+        yield output, lambda: output
+
+def atomic_write(path, data):
+    """Écrit des octets via un fichier temporaire renommé : le fichier final est
+    soit absent, soit complet, jamais à moitié écrit."""
+    with span("disk.write", file=os.path.basename(path), bytes=len(data)), open_output(path) as (f, _):
+        f.write(data)
+
+# --- ÉCRITURE DES EXPORTS EN ARRIÈRE-PLAN ---
+# Niveau zlib des PNG exportés (0 = rapide et gros, 9 = lent et compact ; 6 par défaut dans PIL)
+PNG_COMPRESS_LEVEL = int(os.environ.get("PNG_COMPRESS_LEVEL", "6"))
+
+class ExportWriter:
+    """Écriture des artefacts en arrière-plan : encodage PNG en parallèle (zlib
+    libère le GIL) et écriture atomique, sans bloquer le thread qui produit.
+
+    Chaque écriture retourne un Future. `after(futures, func)` lance func dans le
+    pool quand ces écritures sont terminées, sans immobiliser de thread en attente.
+    `shutdown()` attend aussi ces suites : aucune n'est perdue à la fermeture.
+    """
+    def __init__(self, max_workers=4, compress_level=PNG_COMPRESS_LEVEL):
+        self.compress_level = compress_level
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="export")
+        self._chains = set()
+        self._chains_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def write_image(self, path, image):
+        return self._pool.submit(self._save_png, path, image)
+
+    def write_bytes(self, path, data):
+        return self._pool.submit(atomic_write, path, data)
+
+    def _save_png(self, path, image):
+        with span("disk.write", file=os.path.basename(path)), open_output(path) as (f, _):
+            image.save(f, format="PNG", compress_level=self.compress_level)
+
+    def after(self, futures, func, *args):
+        result = Future()
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def relay(inner):
+            if inner.exception() is not None:
+                result.set_exception(inner.exception())
+            else:
+                result.set_result(inner.result())
+
+        def countdown(_):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                self._pool.submit(func, *args).add_done_callback(relay)
+
+        with self._chains_lock:
+            self._chains.add(result)
+        result.add_done_callback(self._chain_done)
+        if not futures:
+            self._pool.submit(func, *args).add_done_callback(relay)
+        for future in futures:
+            future.add_done_callback(countdown)
+        return result
+
+    def _chain_done(self, result):
+        with self._chains_lock:
+            self._chains.discard(result)
+
+    def shutdown(self, wait=True):
+        """Ferme le pool ; avec `wait`, attend d'abord que les suites `after` en
+        attente (et celles qu'elles enchaînent) aient tourné."""
+        while wait:
+            with self._chains_lock:
+                pending = list(self._chains)
+            if not pending:
+                break
+            futures_wait(pending)
+        self._pool.shutdown(wait=wait)
+
+# --- CACHE DISQUE DES RÉPONSES GEMINI ---
+# Clé = hash(modèle + prompt + image d'entrée) ; les entrées les moins récemment
+# utilisées sont supprimées au-delà de la taille maximale.
+GEMINI_CACHE_DIR = os.environ.get("GEMINI_CACHE_DIR", ".gemini_cache")
+GEMINI_CACHE_MAX_BYTES = 500 * 1024 * 1024
+
+def gemini_cache_key(model_id, prompt, image_bytes=None):
+    h = hashlib.sha256()
+    for part in (model_id.encode(), prompt.encode(), image_bytes or b""):
+        h.update(hashlib.sha256(part).digest())
+    return h.hexdigest()
+
+def _cache_path(key, ext):
+    return os.path.join(GEMINI_CACHE_DIR, key[:2], key + ext)
+
+def cache_get(key, ext):
+    """Retourne les octets en cache (et les marque comme récemment utilisés) ou None"""
+    path = _cache_path(key, ext)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    os.utime(path)
+    return data
+
+def cache_put(key, ext, data):
+    """Écrit une entrée de façon atomique puis applique la limite de taille"""
+    atomic_write(_cache_path(key, ext), data)
+    _evict_cache()
+
+def _evict_cache():
+    evict_lru(GEMINI_CACHE_DIR, GEMINI_CACHE_MAX_BYTES)
+
+def evict_lru(folder, max_bytes):
+    """Supprime les fichiers les moins récemment utilisés (mtime) de `folder` jusqu'à
+    repasser sous `max_bytes`. Les écritures en cours (.tmp) ne sont jamais touchées."""
+    entries = []
+    for root, _, files in os.walk(folder):
+        for name in files:
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                info = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((info.st_mtime, info.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+def _stream_image(model_id, contents):
+    """Appel Gemini en stream, retourne les octets de la dernière image reçue"""
+    from google.genai import types
+
+    image_data = None
+    GEMINI_RATE_LIMITER.acquire()
+    with span("api.image", model=model_id):
+        for chunk in get_client().models.generate_content_stream(
+            model=model_id,
+            contents=contents,
+            config=types.GenerateContentConfig(response_modalities=["IMAGE"]),
+        ):
+            if chunk.parts and chunk.parts[0].inline_data:
+                image_data = chunk.parts[0].inline_data.data
+    return image_data
+
+def _cached_image_call(model_id, prompt, contents, image_bytes=None, use_cache=True):
+    key = gemini_cache_key(model_id, prompt, image_bytes)
+    image_data = cache_get(key, ".img") if use_cache else None
+    if image_data is None:
+        image_data = _stream_image(model_id, contents)
+        if image_data is None:
+            return None
+        cache_put(key, ".img", image_data)
+    image = Image.open(io.BytesIO(image_data))
+    image.load()  # décodée tout de suite : l'image est ensuite lue par plusieurs threads
+    return image
 
 # --- 2. LOGIQUE IMAGE (PAGE 1) ---
-def generate_pattern_image_func(subject):
-    """Génère l'image source du patron avec le modèle Gemini 2.5 Flash Image"""
+def generate_pattern_image_func(subject, use_cache=True):
+    """Génère l'image source du patron avec le modèle Gemini 2.5 Flash Image.
+    `use_cache=False` force un nouvel appel (la réponse remplace l'entrée en cache)."""
+    from google.genai import types
+
     MODEL_ID = "gemini-2.5-flash-image"
     BASE_PROMPT = """, ultra detailed and well-crafted,
         high contrast illustration with bold black outlines,
@@ -37,210 +327,255 @@ def generate_pattern_image_func(subject):
         vector style, sticker and t-shirt friendly,
         4k, extremely sharp, no text, no watermark"""
     
+    prompt = f"Génère une image de : {subject}{BASE_PROMPT}"
     contents = [
         types.Content(
             role="user",
-            parts=[types.Part.from_text(text=f"Génère une image de : {subject}{BASE_PROMPT}")],
+            parts=[types.Part.from_text(text=prompt)],
         ),
     ]
-
-    image_result = None
-    for chunk in client.models.generate_content_stream(
-        model=MODEL_ID,
-        contents=contents,
-        config=types.GenerateContentConfig(response_modalities=["IMAGE"]),
-    ):
-        if chunk.parts and chunk.parts[0].inline_data:
-            image_data = chunk.parts[0].inline_data.data
-            image_result = Image.open(io.BytesIO(image_data))
-            
-    return image_result
+    return _cached_image_call(MODEL_ID, prompt, contents, use_cache=use_cache)
 
 # --- 3. LOGIQUE TECHNIQUE DMC (PAGE 2) ---
-def get_closest_dmc(rgb):
-    r, g, b = rgb
-    best_match = DMC_DB[0]
-    min_dist = float('inf')
-    for color in DMC_DB:
-        dist = ((color["r"]-r)**2 + (color["g"]-g)**2 + (color["b"]-b)**2)**0.5
-        if dist < min_dist:
-            min_dist = dist
-            best_match = color
-    return best_match
-
-def process_image(image, size, num_colors):
-    img = ImageOps.contain(image, (size, size))
-    img = img.convert("P", palette=Image.Palette.ADAPTIVE, colors=num_colors).convert("RGB")
-    return img
-
-def get_used_colors_data(processed_img):
-    used_colors = {}
-    symbols = "123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ#@$§&?%WX+"
-    sym_idx = 0
-    cols, rows = processed_img.size
-    for y in range(rows):
-        for x in range(cols):
-            pixel = processed_img.getpixel((x, y))
-            dmc = get_closest_dmc(pixel)
-            if dmc["floss"] not in used_colors:
-                used_colors[dmc["floss"]] = {
-                    "info": dmc, 
-                    "count": 0, 
-                    "sym": symbols[sym_idx % len(symbols)]
-                }
-                sym_idx += 1
-            used_colors[dmc["floss"]]["count"] += 1
-    return used_colors
-
-# --- 4. GÉNÉRATEURS DE PDF (PAGE 2) ---
-
-def generate_flosscross_pdf(processed_img, user_texts, bw_mode, used_colors):
-    buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
-    margin = 50
-    rows, cols = processed_img.size
-
-    # PAGE 1 : COUVERTURE
-    c.setFont("Helvetica", 14)
-    c.drawCentredString(width/2, height - 50, user_texts['main_title'])
-    c.setLineWidth(0.5)
-    c.line(margin, height - 70, width - margin, height - 70)
-    
-    img_display_w = 350
-    img_display_h = (rows/cols) * img_display_w
-    c.drawInlineImage(processed_img, (width-img_display_w)/2, height-450, width=img_display_w, height=img_display_h)
-    
-    c.setFont("Helvetica", 10)
-    c.drawCentredString(width/2, height-500, f"Design size: {cols} x {rows} stitches")
-    c.drawString(margin, 100, user_texts['import_note'])
-    c.drawString(margin, 60, user_texts['copyright'])
-    c.drawRightString(width - margin, 60, "Page 1")
-
-    # CONFIGURATION GRILLE
-    MAX_POINTS_PER_PAGE = 50
-    num_pages_x = (cols + MAX_POINTS_PER_PAGE - 1) // MAX_POINTS_PER_PAGE
-    num_pages_y = (rows + MAX_POINTS_PER_PAGE - 1) // MAX_POINTS_PER_PAGE
-    current_page_num = 2 
-
-    # GÉNÉRATION DES PAGES
-    for py in range(num_pages_y):
-        for px in range(num_pages_x):
-            c.showPage()
-            c.setFont("Helvetica-Bold", 10)
-            c.drawCentredString(width/2, height - 25, f"{user_texts['main_title']} - Part {px+1},{py+1}")
-            
-            x_start, x_end = px * MAX_POINTS_PER_PAGE, min((px+1)*MAX_POINTS_PER_PAGE, cols)
-            y_start, y_end = py * MAX_POINTS_PER_PAGE, min((py+1)*MAX_POINTS_PER_PAGE, rows)
-            
-            current_w, current_h = x_end - x_start, y_end - y_start
-            cell_size = min((width - 100) / current_w, (height - 120) / current_h)
-            draw_x, draw_y = (width - (current_w * cell_size)) / 2, (height - 60)
-            
-            for y in range(y_start, y_end):
-                for x in range(x_start, x_end):
-                    pixel = processed_img.getpixel((x, y))
-                    dmc = get_closest_dmc(pixel)
-                    data = used_colors[dmc["floss"]]
-                    local_x = draw_x + (x - x_start) * cell_size
-                    local_y = draw_y - (y - y_start + 1) * cell_size
-                    
-                    if bw_mode:
-                        luma = (dmc["r"] * 0.299 + dmc["g"] * 0.587 + dmc["b"] * 0.114) / 255
-                        adj = 0.6 + (luma * 0.4) 
-                        fill_color, text_color, line_color = (adj, adj, adj), colors.black, colors.grey
-                    else:
-                        fill_color = (dmc["r"]/255, dmc["g"]/255, dmc["b"]/255)
-                        line_color = colors.lightgrey
-                        bright = (dmc["r"] * 299 + dmc["g"] * 587 + dmc["b"] * 114) / 1000
-                        text_color = colors.white if bright < 125 else colors.black
-
-                    c.setLineWidth(0.1)
-                    c.setStrokeColor(line_color)
-                    if x % 10 == 0 or y % 10 == 0:
-                        c.setLineWidth(0.7)
-                        c.setStrokeColor(colors.black)
-                    
-                    c.setFillColorRGB(*fill_color)
-                    c.rect(local_x, local_y, cell_size, cell_size, fill=1, stroke=1)
-                    c.setFillColor(text_color)
-                    c.setFont("Helvetica", cell_size * 0.7)
-                    c.drawCentredString(local_x + cell_size/2, local_y + cell_size/4, data["sym"])
-            
-            c.setFont("Helvetica", 8)
-            c.drawRightString(width - margin, 30, f"Page {current_page_num}")
-            current_page_num += 1
-
-    # PAGE LÉGENDE
-    c.showPage()
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(margin, height - 50, "Thread Legend (DMC)")
-    y_pos = height - 100
-    for floss_code, data in used_colors.items():
-        if bw_mode:
-            c.setFillColor(colors.white)
-            c.setStrokeColor(colors.black)
-            c.rect(margin, y_pos - 2, 12, 12, fill=1, stroke=1)
-            c.setFillColor(colors.black)
-        else:
-            c.setFillColorRGB(data["info"]["r"]/255, data["info"]["g"]/255, data["info"]["b"]/255)
-            c.rect(margin, y_pos - 2, 12, 12, fill=1)
-            bright = (data["info"]["r"] * 299 + data["info"]["g"] * 587 + data["info"]["b"] * 114) / 1000
-            c.setFillColor(colors.white if bright < 125 else colors.black)
-        
-        c.drawCentredString(margin + 6, y_pos + 1, data["sym"])
-        c.setFillColor(colors.black)
-        c.drawString(margin + 40, y_pos, str(floss_code))
-        c.drawString(margin + 100, y_pos, data["info"]["description"])
-        c.drawString(margin + 300, y_pos, str(data["count"]))
-        y_pos -= 20
-        if y_pos < 50:
-            c.showPage()
-            y_pos = height - 50
-    
-    c.save()
-    return buffer.getvalue()
-
-def generate_pk_pdf(processed_img, used_colors):
-    buffer = io.BytesIO()
-    rows, cols = processed_img.size
-    cell_size = 15
-    pw, ph = (cols * cell_size) + 100, (rows * cell_size) + 150
-    c = canvas.Canvas(buffer, pagesize=(pw, ph))
-    draw_x, draw_y = 50, ph - 50
-    for y in range(rows):
-        for x in range(cols):
-            pixel = processed_img.getpixel((x, y))
-            dmc = get_closest_dmc(pixel)
-            data = used_colors[dmc["floss"]]
-            rx, ry = draw_x + (x * cell_size), draw_y - ((y + 1) * cell_size)
-            c.setLineWidth(0.1)
-            c.setStrokeColor(colors.lightgrey)
-            c.setFillColorRGB(dmc["r"]/255, dmc["g"]/255, dmc["b"]/255)
-            c.rect(rx, ry, cell_size, cell_size, fill=1)
-            bright = (dmc["r"] * 299 + dmc["g"] * 587 + dmc["b"] * 114) / 1000
-            c.setFillColor(colors.white if bright < 125 else colors.black)
-            c.setFont("Helvetica", cell_size * 0.6)
-            c.drawCentredString(rx + cell_size/2, ry + cell_size/4, data["sym"])
-    
-    # Légende simplifiée pour Pattern Keeper
-    y_leg = draw_y - (rows * cell_size) - 40
-    c.setFillColor(colors.black)
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(draw_x, y_leg, "Legend")
-    y_leg -= 20
-    for code, data in used_colors.items():
-        c.drawString(draw_x, y_leg, f"DMC {code} - {data['info']['description']}")
-        y_leg -= 15
-        if y_leg < 20: break
+def rgb_to_lab(rgb):
+    """Convertit un tableau (..., 3) de couleurs sRGB 0-255 en CIELAB (illuminant D65)"""
+    c = np.asarray(rgb, dtype=np.float64) / 255
+    c = np.where(c > 0.04045, ((c + 0.055) / 1.055) ** 2.4, c / 12.92)
+    xyz = c @ np.array([
+        [0.4124564, 0.3575761, 0.1804375],
+        [0.2126729, 0.7151522, 0.0721750],
+        [0.0193339, 0.1191920, 0.9503041],
+    ]).T / np.array([0.95047, 1.0, 1.08883])
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.stack([
+        116 * f[..., 1] - 16,
+        500 * (f[..., 0] - f[..., 1]),
+        200 * (f[..., 1] - f[..., 2]),
+    ], axis=-1)
+
+def match_dmc_indices(pixels):
+    """Associe chaque pixel d'un tableau (H, W, 3) à l'index DMC le plus proche.
+
+    Distance euclidienne en RGB, calculée de façon vectorisée sur les seules couleurs
+    uniques de l'image : exacte pour les images déjà quantifiées en couleurs DMC.
+    """
+    arr = np.asarray(pixels, dtype=np.int32)[..., :3]
+    flat = arr.reshape(-1, 3)
+    packed = (flat[:, 0] << 16) | (flat[:, 1] << 8) | flat[:, 2]
+    uniq, inverse = np.unique(packed, return_inverse=True)
+    uniq_rgb = np.stack([(uniq >> 16) & 255, (uniq >> 8) & 255, uniq & 255], axis=1)
+
+    best = np.empty(len(uniq), dtype=np.intp)
+    chunk = 4096  # borne la matrice de distances à ~4096 x 454
+    for start in range(0, len(uniq), chunk):
+        diff = uniq_rgb[start:start + chunk, None, :] - DMC_RGB[None, :, :]
+        best[start:start + chunk] = np.einsum("ijk,ijk->ij", diff, diff).argmin(axis=1)
+    return best[inverse.reshape(-1)].reshape(arr.shape[:-1])
 
-    c.save()
-    return buffer.getvalue()
+def get_closest_dmc(rgb):
+    """Fil DMC perceptuellement le plus proche d'une couleur quelconque (distance CIELAB,
+    comme la quantification)"""
+    return DMC_DB[int(_nearest_lab(rgb_to_lab(np.asarray([rgb[:3]])), DMC_LAB)[0])]
+
+def image_hash(image):
+    """Empreinte du contenu d'une image PIL (mode, taille et pixels)"""
+    h = hashlib.sha256(f"{image.mode}{image.size}".encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+DMC_LAB = rgb_to_lab(DMC_RGB)
+
+# Matrice de Bayer 4x4 normalisée dans [-0.5, 0.5) pour le tramage ordonné
+BAYER_4 = (np.array([[0, 8, 2, 10], [12, 4, 14, 6], [3, 11, 1, 9], [15, 7, 13, 5]]) + 0.5) / 16 - 0.5
+DITHER_MODES = (None, "ordered", "floyd")
+
+# Grands formats : la grille va jusqu'à 1000 points de côté ; la conversion Lab et
+# l'affectation des pixels se font par bandes de lignes pour borner la mémoire.
+MAX_GRID_SIZE = 1000
+QUANT_TILE_PIXELS = 65536
+
+def _nearest_lab(points, centers):
+    """Index du centre le plus proche de chaque point (distance euclidienne en Lab).
+    |a-b|² = |a|² - 2ab + |b|² : un produit matriciel par bloc, sans tableau (N, K, 3)."""
+    centers_sq = (centers ** 2).sum(axis=1)
+    best = np.empty(len(points), dtype=np.intp)
+    chunk = 8192
+    for start in range(0, len(points), chunk):
+        block = points[start:start + chunk]
+        dist = centers_sq[None, :] - 2 * block @ centers.T
+        best[start:start + chunk] = dist.argmin(axis=1)
+    return best
+
+def _lab_in_chunks(rgb):
+    """rgb_to_lab par blocs : les temporaires flottants restent de taille fixe"""
+    lab = np.empty((len(rgb), 3))
+    for start in range(0, len(rgb), QUANT_TILE_PIXELS):
+        lab[start:start + QUANT_TILE_PIXELS] = rgb_to_lab(rgb[start:start + QUANT_TILE_PIXELS])
+    return lab
+
+def _snap_to_dmc(centers, weights):
+    """Remplace chaque centre par le fil DMC le plus proche, sans doublon :
+    les clusters les plus lourds choisissent en premier."""
+    dist = ((centers[:, None, :] - DMC_LAB[None, :, :]) ** 2).sum(axis=2)
+    flosses = np.empty(len(centers), dtype=np.intp)
+    used = set()
+    for k in np.argsort(-weights, kind="stable"):
+        flosses[k] = next(f for f in np.argsort(dist[k]) if f not in used)
+        used.add(flosses[k])
+    return flosses
+
+def select_dmc_palette(lab, weights, num_colors, iterations=20):
+    """Choisit au plus `num_colors` fils DMC pour des couleurs Lab pondérées.
+
+    K-means pondéré dans l'espace Lab, dont les centres sont ramenés sur des fils
+    DMC distincts à chaque itération (initialisation k-means++ déterministe).
+    Retourne les index DMC retenus.
+    """
+    snapped = np.unique(_nearest_lab(lab, DMC_LAB))
+    if len(snapped) <= num_colors:
+        return snapped
+
+    rng = np.random.RandomState(0)
+    probs = weights / weights.sum()
+    centers = [lab[rng.choice(len(lab), p=probs)]]
+    closest = ((lab - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, num_colors):
+        scores = weights * closest
+        centers.append(lab[rng.choice(len(lab), p=scores / scores.sum())])
+        closest = np.minimum(closest, ((lab - centers[-1]) ** 2).sum(axis=1))
+    centers = np.array(centers)
+
+    flosses = None
+    for _ in range(iterations):
+        labels = _nearest_lab(lab, centers)
+        cluster_weights = np.bincount(labels, weights=weights, minlength=num_colors)
+        sums = np.stack([np.bincount(labels, weights=weights * lab[:, i], minlength=num_colors) for i in range(3)], axis=1)
+        filled = cluster_weights > 0
+        centers[filled] = sums[filled] / cluster_weights[filled, None]
+        new_flosses = _snap_to_dmc(centers, cluster_weights)
+        if flosses is not None and np.array_equal(new_flosses, flosses):
+            break
+        flosses = new_flosses
+        centers = DMC_LAB[flosses]
+    return flosses
+
+def quantize_to_dmc(img, num_colors, dither=None):
+    """Quantifie une image RGB directement sur au plus `num_colors` fils DMC.
+
+    Les pixels de sortie sont exactement les couleurs RGB des fils retenus.
+    `dither` : None, "ordered" (Bayer 4x4) ou "floyd" (Floyd–Steinberg, via PIL).
+    La palette est choisie sur les couleurs uniques de toute l'image, puis les pixels
+    sont affectés par bandes de lignes : mémoire et temps linéaires en nombre de points.
+    """
+    rgb_img = img.convert("RGB")
+    arr = np.asarray(rgb_img)
+    h, w = arr.shape[:2]
+    packed = (arr[..., 0].astype(np.int32) << 16) | (arr[..., 1].astype(np.int32) << 8) | arr[..., 2]
+    uniq, inverse, counts = np.unique(packed.reshape(-1), return_inverse=True, return_counts=True)
+    uniq_rgb = np.stack([(uniq >> 16) & 255, (uniq >> 8) & 255, uniq & 255], axis=1)
+    uniq_lab = _lab_in_chunks(uniq_rgb)
+    flosses = select_dmc_palette(uniq_lab, counts.astype(np.float64), num_colors)
+    floss_rgb = DMC_RGB[flosses].astype(np.uint8)
+
+    if dither == "floyd":
+        # Le tramage par diffusion d'erreur est séquentiel : PIL le fait en C sur la palette imposée
+        palette_img = Image.new("P", (1, 1))
+        padded = np.concatenate([floss_rgb, np.repeat(floss_rgb[-1:], 256 - len(floss_rgb), axis=0)])
+        palette_img.putpalette(padded.reshape(-1).tolist())
+        return rgb_img.quantize(palette=palette_img, dither=Image.Dither.FLOYDSTEINBERG).convert("RGB")
+
+    out = np.empty((h, w, 3), dtype=np.uint8)
+    tile_rows = max(4, QUANT_TILE_PIXELS // max(w, 1) // 4 * 4)  # multiple de 4 : motif de Bayer continu
+    if dither == "ordered":
+        spread = 255 / max(2, round(len(flosses) ** (1 / 3)))
+        offsets = np.tile(BAYER_4, (tile_rows // 4, w // 4 + 1))[:, :w, None] * spread
+        centers = DMC_LAB[flosses]
+        for y in range(0, h, tile_rows):
+            band = arr[y:y + tile_rows]
+            noisy = np.clip(band + offsets[:len(band)], 0, 255)
+            out[y:y + tile_rows] = floss_rgb[_nearest_lab(rgb_to_lab(noisy).reshape(-1, 3), centers)].reshape(band.shape)
+    else:
+        uniq_labels = _nearest_lab(uniq_lab, DMC_LAB[flosses])
+        inverse = inverse.reshape(h, w)
+        for y in range(0, h, tile_rows):
+            out[y:y + tile_rows] = floss_rgb[uniq_labels[inverse[y:y + tile_rows]]]
+    return Image.fromarray(out)
+
+def process_image(image, size, num_colors, dither=None):
+    """Réduit l'image à `size` points de côté et la quantifie sur `num_colors` fils DMC au plus"""
+    with span("pixelize", size=size, colors=num_colors, dither=dither):
+        img = ImageOps.contain(image.convert("RGB"), (size, size))
+        return quantize_to_dmc(img, num_colors, dither)
+
+SYMBOLS = "123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ#@$§&?%WX+"
+
+class PatternModel:
+    """Modèle de patron calculé une seule fois et partagé par tous les générateurs.
+
+    - palette : entrées DMC dans l'ordre d'apparition (lecture ligne par ligne)
+    - grid : index dans `palette` pour chaque point, tableau (rows, cols) uint8/uint16
+    - counts : nombre de points par entrée de palette
+    - symbols : symbole attribué à chaque entrée de palette
+    """
+    def __init__(self, image, palette, grid, counts, symbols):
+        self.image = image
+        self.palette = palette
+        self.grid = grid
+        self.counts = counts
+        self.symbols = symbols
+
+    @property
+    def rows(self):
+        return self.grid.shape[0]
+
+    @property
+    def cols(self):
+        return self.grid.shape[1]
+
+    @property
+    def used_colors(self):
+        """Vue compatible avec l'ancien format {floss: {info, count, sym}}"""
+        return {
+            dmc["floss"]: {"info": dmc, "count": int(count), "sym": sym}
+            for dmc, count, sym in zip(self.palette, self.counts, self.symbols)
+        }
+
+def build_pattern_model(processed_img):
+    """Construit le PatternModel à partir de la sortie de process_image.
+
+    L'image quantifiée n'a que quelques dizaines de couleurs : la recherche DMC
+    se fait donc une fois par couleur de palette, pas une fois par pixel.
+    Les couleurs issues de quantize_to_dmc (choisies en CIELAB) sont déjà des
+    fils DMC exacts : la correspondance RGB les retrouve telles quelles.
+    """
+    arr = np.asarray(processed_img.convert("RGB"), dtype=np.int32)
+    packed = (arr[..., 0] << 16) | (arr[..., 1] << 8) | arr[..., 2]
+    uniq, inverse = np.unique(packed.reshape(-1), return_inverse=True)
+    uniq_rgb = np.stack([(uniq >> 16) & 255, (uniq >> 8) & 255, uniq & 255], axis=1)
+    with span("dmc_match", colors=len(uniq)):
+        dmc_indices = match_dmc_indices(uniq_rgb)[inverse.reshape(-1)]
+
+    # Ordre d'apparition pour garder une attribution des symboles stable
+    uniq_dmc, first_pos, local, counts = np.unique(
+        dmc_indices, return_index=True, return_inverse=True, return_counts=True
+    )
+    order = np.argsort(first_pos)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
 
+    dtype = np.uint8 if len(order) <= 256 else np.uint16
+    grid = rank[local.reshape(-1)].astype(dtype).reshape(packed.shape)
+    palette = [DMC_DB[int(uniq_dmc[i])] for i in order]
+    symbols = [SYMBOLS[i % len(SYMBOLS)] for i in range(len(order))]
+    return PatternModel(processed_img, palette, grid, counts[order], symbols)
 
+def get_used_colors_data(processed_img):
+    return build_pattern_model(processed_img).used_colors
 
-def generate_mockup_func(processed_image):
+def generate_mockup_func(processed_image, use_cache=True):
     """Génère le mockup à partir de l'image pixelisée (Page 3)"""
+    from google.genai import types
+
     MODEL_ID = "gemini-2.5-flash-image"
     
     # On s'assure que l'image est nette pour l'IA
@@ -250,12 +585,7 @@ def generate_mockup_func(processed_image):
     buffered = io.BytesIO()
     sharp_image.save(buffered, format="PNG")
     
-    contents = [
-        types.Content(
-            role="user",
-            parts=[
-                types.Part.from_bytes(mime_type="image/png", data=buffered.getvalue()),
-                types.Part.from_text(text=f"""
+    prompt = """
                     Professional Etsy product photography of a finished cross-stitch embroidery. 
                     The central design is placed inside a circular wooden embroidery hoop. 
                     IMPORTANT: The embroidery is perfectly centered, no fabric is hanging out of the hoop. 
@@ -263,22 +593,17 @@ def generate_mockup_func(processed_image):
                     SCENE: Placed on a cozy, slightly blurred (bokeh) wooden table background with a pair of vintage scissors and some skeins of DMC thread next to it. 
                     LIGHTING: Soft natural morning light, realistic shadows, high resolution, 8k, macro photography. 
                     STRICT RULE: Do not modify or add any elements to the original cross-stitch pattern provided, keep the design exactly as shown.
-                    """),
+                    """
+    contents = [
+        types.Content(
+            role="user",
+            parts=[
+                types.Part.from_bytes(mime_type="image/png", data=buffered.getvalue()),
+                types.Part.from_text(text=prompt),
             ],
         ),
     ]
-
-    image_result = None
-    # On utilise ton système de stream habituel
-    for chunk in client.models.generate_content_stream(
-        model=MODEL_ID, 
-        contents=contents, 
-        config=types.GenerateContentConfig(response_modalities=["IMAGE"])
-    ):
-        if chunk.parts and chunk.parts[0].inline_data:
-            image_data = chunk.parts[0].inline_data.data
-            image_result = Image.open(io.BytesIO(image_data))
-    return image_result
+    return _cached_image_call(MODEL_ID, prompt, contents, buffered.getvalue(), use_cache)
 
 def add_pro_badge(target_image):
     """Ajoute le badge 'PDF PATTERN' en gros et lisible"""
@@ -345,7 +670,7 @@ def add_pro_badge(target_image):
 
 
 
-def generate_seo_package(visual_concept, num_colors, grid_size):
+def generate_seo_package(visual_concept, num_colors, grid_size, use_cache=True):
     """Génère le pack SEO avec les vraies specs techniques"""
     MODEL_ID_TEXT = "gemini-2.0-flash"
     
@@ -360,35 +685,38 @@ def generate_seo_package(visual_concept, num_colors, grid_size):
     - "tags": 13 tags, comma-separated.
     """
 
-    response = client.models.generate_content(
-        model=MODEL_ID_TEXT, 
-        contents=seo_prompt,
-        config={'response_mime_type': 'application/json'}
-    )
-    return json.loads(response.text)
+    key = gemini_cache_key(MODEL_ID_TEXT, seo_prompt)
+    cached = cache_get(key, ".json") if use_cache else None
+    if cached is not None:
+        return json.loads(cached)
+
+    GEMINI_RATE_LIMITER.acquire()
+    with span("api.seo", model=MODEL_ID_TEXT):
+        response = get_client().models.generate_content(
+            model=MODEL_ID_TEXT, 
+            contents=seo_prompt,
+            config={'response_mime_type': 'application/json'}
+        )
+    data = json.loads(response.text)
+    # Mis en cache seulement si le JSON est valide
+    cache_put(key, ".json", response.text.encode("utf-8"))
+    return data
 
 
 
 
 
 def load_factory_history():
-    """Charge l'historique des sujets déjà traités depuis le fichier JSON"""
-    file_path = 'factory_history.json'
-    if not os.path.exists(file_path):
-        return []
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, IOError):
-        return []
+    """Liste des sujets déjà traités (lue dans le catalogue SQLite)"""
+    from catalog import init_catalog, list_subjects
+    init_catalog()
+    return list_subjects()
 
 def save_to_factory_history(subject):
     """Ajoute un sujet à l'historique pour éviter les doublons"""
-    history = load_factory_history()
-    if subject not in history:
-        history.append(subject)
-        with open('factory_history.json', 'w', encoding='utf-8') as f:
-            json.dump(history, f, ensure_ascii=False, indent=4)
+    from catalog import init_catalog, add_subject
+    init_catalog()
+    add_subject(subject)
 
 
 
@@ -400,4 +728,140 @@ def ensure_export_dir():
 def get_all_saved_products():
     """Récupère la liste des dossiers de produits déjà générés"""
     ensure_export_dir()
-    return [d for d in os.listdir("exports") if os.path.isdir(os.path.join("exports", d))]
\ No newline at end of file
+    return [d for d in os.listdir("exports") if os.path.isdir(os.path.join("exports", d))]
+
+# --- MINIATURES PRODUIT ---
+THUMB_DIR = "thumbs"
+THUMB_SIZE = 320
+
+def thumbnail_path(prod_path, name):
+    """Chemin de la miniature d'un fichier image du produit (ex: "2_pix.png")"""
+    base, _ = os.path.splitext(name)
+    # Le rendu pixelisé reste en PNG (net), les photos passent en JPEG (léger)
+    ext = ".png" if name == "2_pix.png" else ".jpg"
+    return os.path.join(prod_path, THUMB_DIR, base + ext)
+
+def write_thumbnails(prod_path, images=None):
+    """Crée les miniatures des 3 images d'un produit à l'export.
+
+    `images` : {nom de fichier: image PIL} déjà en mémoire ; sinon les fichiers
+    sont relus depuis le disque (rattrapage des anciens exports)."""
+    for name in ("1_ref.png", "2_pix.png", "3_mockup.png"):
+        img = (images or {}).get(name)
+        if img is None:
+            src = os.path.join(prod_path, name)
+            if not os.path.exists(src):
+                continue
+            with Image.open(src) as f:
+                img = f.convert("RGB")
+        thumb = img.convert("RGB")
+        if name == "2_pix.png":
+            # Redimensionné sans lissage pour garder des points nets : agrandi d'un
+            # facteur entier pour les petites grilles, réduit pour les grandes
+            if max(thumb.size) > THUMB_SIZE:
+                thumb.thumbnail((THUMB_SIZE, THUMB_SIZE), Image.NEAREST)
+            else:
+                scale = THUMB_SIZE // max(thumb.size)
+                thumb = thumb.resize((thumb.width * scale, thumb.height * scale), Image.NEAREST)
+        else:
+            thumb.thumbnail((THUMB_SIZE, THUMB_SIZE))
+        buf = io.BytesIO()
+        thumb.save(buf, format="PNG" if name == "2_pix.png" else "JPEG", quality=85)
+        atomic_write(thumbnail_path(prod_path, name), buf.getvalue())
+
+def ensure_thumbnails(prod_path):
+    """Rattrape les miniatures manquantes dont l'image source existe ;
+    retourne {nom de fichier: chemin de la miniature ou None}"""
+    names = ("1_ref.png", "2_pix.png", "3_mockup.png")
+    if any(not os.path.exists(thumbnail_path(prod_path, name)) and os.path.exists(os.path.join(prod_path, name))
+           for name in names):
+        write_thumbnails(prod_path)
+    return {name: thumbnail_path(prod_path, name) if os.path.exists(thumbnail_path(prod_path, name)) else None
+            for name in names}
+
+# --- ÉTAT DE PRODUCTION (REPRISE) ---
+STATE_NAME = "state.json"
+PRODUCT_FILES = ("1_ref.png", "2_pix.png", "3_mockup.png", "seo.txt", "color.pdf", "bw.pdf", "pk.pdf")
+
+def load_state(prod_path):
+    """État de production d'un produit : étapes terminées, réglages, complet ou non"""
+    try:
+        with open(os.path.join(prod_path, STATE_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"stages": []}
+
+def save_state(prod_path, state):
+    atomic_write(os.path.join(prod_path, STATE_NAME), json.dumps(state, ensure_ascii=False, indent=2).encode("utf-8"))
+
+def is_product_complete(prod_path):
+    """Un produit n'est terminé que si son état le dit ; les anciens exports (sans
+    state.json) le sont si tous leurs fichiers sont présents."""
+    if os.path.exists(os.path.join(prod_path, STATE_NAME)):
+        return bool(load_state(prod_path).get("complete"))
+    return all(os.path.exists(os.path.join(prod_path, name)) for name in PRODUCT_FILES)
+
+# --- MANIFESTE PRODUIT ---
+MANIFEST_NAME = "manifest.json"
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def write_manifest(prod_path, subject, model):
+    """Écrit exports/<produit>/manifest.json : taille de grille, fils et comptes,
+    symboles, empreintes et dates des fichiers. Les pages lisent ce fichier au
+    lieu de redécoder les images."""
+    files = {}
+    for name in sorted(os.listdir(prod_path)):
+        path = os.path.join(prod_path, name)
+        if name in (MANIFEST_NAME, STATE_NAME) or name.endswith(".tmp") or not os.path.isfile(path):
+            continue
+        info = os.stat(path)
+        files[name] = {
+            "sha256": _file_sha256(path),
+            "bytes": info.st_size,
+            "modified_at": datetime.fromtimestamp(info.st_mtime, timezone.utc).isoformat(),
+        }
+    manifest = {
+        "subject": subject,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "grid": {"cols": model.cols, "rows": model.rows},
+        "num_colors": len(model.palette),
+        "stitches": int(sum(model.counts)),
+        "flosses": [
+            {"floss": dmc["floss"], "description": dmc["description"],
+             "hex": f"{dmc['r']:02X}{dmc['g']:02X}{dmc['b']:02X}",
+             "symbol": sym, "count": int(count)}
+            for dmc, count, sym in zip(model.palette, model.counts, model.symbols)
+        ],
+        "symbols": {sym: dmc["floss"] for dmc, sym in zip(model.palette, model.symbols)},
+        "files": files,
+    }
+    atomic_write(os.path.join(prod_path, MANIFEST_NAME),
+                 json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+    return manifest
+
+def load_manifest(prod_path):
+    """Lit le manifeste d'un produit ; les anciens exports sans manifeste sont
+    analysés une seule fois à partir de 2_pix.png puis complétés."""
+    if not is_product_complete(prod_path):
+        return None
+    path = os.path.join(prod_path, MANIFEST_NAME)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        pass
+    except json.JSONDecodeError:
+        return None
+    pix_path = os.path.join(prod_path, "2_pix.png")
+    if not os.path.exists(pix_path):
+        return None
+    with Image.open(pix_path) as img:
+        model = build_pattern_model(img.convert("RGB"))
+    subject = os.path.basename(os.path.normpath(prod_path)).replace("_", " ")
+    return write_manifest(prod_path, subject, model)
@@ -0,0 +1,86 @@
+"""Worker de production détaché : exécute les jobs de la file du catalogue SQLite,
+indépendamment de Streamlit (les lots survivent à la fermeture de l'onglet).
+
+Usage : python worker.py [--concurrency 3] [--rate 10] [--png-compression 6]
+"""
+import os
+import json
+import time
+import argparse
+import threading
+from utils import GEMINI_RATE_LIMITER, PNG_COMPRESS_LEVEL, ExportWriter
+from catalog import (
+    init_catalog, claim_job, log_job, finish_job, requeue_stale_jobs, release_jobs, set_worker_heartbeat
+)
+from factory import submit_subject
+
+def _close_job(job_id, error):
+    if error is None:
+        log_job(job_id, "✅ Terminé")
+        finish_job(job_id, "done")
+    else:
+        log_job(job_id, f"❌ Erreur : {error}")
+        finish_job(job_id, "failed", str(error))
+
+def work_loop(stop, poll_interval, writer):
+    """Boucle d'un thread : prend un job, fait ses calculs et appels API, puis passe au
+    suivant pendant que `writer` écrit ses fichiers ; le job est clos une fois écrit."""
+    pid = os.getpid()
+    while not stop.is_set():
+        job = claim_job(pid)
+        if job is None:
+            stop.wait(poll_interval)
+            continue
+        job_id = job["id"]
+        params = json.loads(job["params"])
+        params.pop("perceptual", None)  # option retirée : jobs mis en file par une ancienne version
+        try:
+            written = submit_subject(job["subject"], writer=writer,
+                                     report=lambda message, job_id=job_id: log_job(job_id, message), **params)
+        except Exception as e:
+            _close_job(job_id, e)
+        else:
+            written.add_done_callback(lambda future, job_id=job_id: _close_job(job_id, future.exception()))
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker de la file de production Etsy Factory")
+    parser.add_argument("--concurrency", type=int, default=3, help="sujets produits en parallèle")
+    parser.add_argument("--rate", type=int, default=10, help="appels API Gemini par minute")
+    parser.add_argument("--poll", type=float, default=2.0, help="intervalle de scrutation de la file (s)")
+    parser.add_argument("--png-compression", type=int, default=PNG_COMPRESS_LEVEL, choices=range(10),
+                        metavar="0-9", help="niveau de compression des PNG exportés")
+    args = parser.parse_args()
+
+    init_catalog()
+    GEMINI_RATE_LIMITER.configure(args.rate, burst=2)
+    # Jobs laissés par un ancien process du même pid, puis signe de vie : seuls les
+    # jobs des workers morts sont repris, ceux des autres workers vivants restent à eux
+    pid = os.getpid()
+    requeued = release_jobs(pid)
+    set_worker_heartbeat(pid)
+    requeued += requeue_stale_jobs(pid)
+    print(f"Worker {os.getpid()} démarré ({args.concurrency} en parallèle, {args.rate} appels/min, {requeued} jobs repris)")
+
+    stop = threading.Event()
+    # Un seul pool d'écriture partagé par tous les jobs du worker
+    writer = ExportWriter(compress_level=args.png_compression)
+    threads = [threading.Thread(target=work_loop, args=(stop, args.poll, writer), daemon=True)
+               for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            set_worker_heartbeat(pid)
+            requeued = requeue_stale_jobs(pid)
+            if requeued:
+                print(f"{requeued} job(s) abandonné(s) remis en file")
+            time.sleep(5)
+    except KeyboardInterrupt:
+        print("Arrêt demandé : fin des jobs en cours...")
+        stop.set()
+        for thread in threads:
+            thread.join()
+        writer.shutdown()
+
+if __name__ == "__main__":
+    main()